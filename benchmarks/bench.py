@@ -0,0 +1,269 @@
+"""Benchmarks for every stage of the lexer: parsing regexes, the thompson construction, the subset construction,
+minimization, accepting words with the dfa and lexing.
+
+Run it from the root of the repository:
+
+    python benchmarks/bench.py                          # run everything and print a table
+    python benchmarks/bench.py --save baseline.json     # also save the results as a baseline
+    python benchmarks/bench.py --compare baseline.json  # flag the stages that got slower than the baseline
+
+The specs and inputs are generated from a fixed seed, so runs on the same machine are comparable. Only the standard
+library is needed.
+"""
+from argparse import ArgumentParser
+from collections.abc import Callable
+from time import perf_counter
+import json
+import os
+import platform
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.Lexer import Lexer
+from src.Regex import parse_regex
+
+SEED = 1234
+UNITS = {'B': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+
+
+# specs: each generator returns the spec of a lexer and the words its inputs are made of
+
+def keywords(n: int) -> tuple[list[tuple[str, str]], list[str]]:
+    # n keywords, all of which are also matched by the identifier rule
+    words = [f'kw{i}' for i in range(n)]
+    spec = [(f'KW{i}', word) for i, word in enumerate(words)]
+    spec += [('ID', '[a-z_][a-z_0-9]*'), ('NUM', '[0-9]+'), ('SPACE', '\\ +')]
+    words += ['name', 'x1', '42', 'other_name']
+    return spec, [word + ' ' for word in words]
+
+
+def nested_stars(depth: int) -> tuple[list[tuple[str, str]], list[str]]:
+    # stars nested depth times, like ((a*b)*c)*, which give nfas with many epsilon transitions
+    regex = 'a*'
+    for i in range(depth):
+        regex = f'({regex}{chr(ord("b") + i % 24)})*'
+    letters = ''.join(chr(ord('b') + i % 24) for i in range(depth))
+    return [('NEST', regex), ('SPACE', '\\ ')], [letters, 'aaa' + letters, letters * 2, ' ']
+
+
+def char_classes(n: int) -> tuple[list[tuple[str, str]], list[str]]:
+    # n rules over large and overlapping unicode ranges, which give many symbol classes
+    spec, words = [], []
+    for i in range(n):
+        lo = 0x100 + i * 0x180
+        spec.append((f'CLASS{i}', f'[{chr(lo)}-{chr(lo + 0x2ff)}]+'))
+        words.append(chr(lo + 0x17f) * 3)
+    spec += [('ASCII', '[a-zA-Z0-9]+'), ('SPACE', '\\ ')]
+    return spec, words + ['abc', ' ']
+
+
+def blowup(n: int) -> tuple[list[tuple[str, str]], list[str]]:
+    # (a|b)*a(a|b)...(a|b) with n (a|b) at the end: the smallest dfa has 2^(n+1) states
+    # the words have an a n + 1 characters before their end, so they are matched by the rule
+    words = ['a' * (n + 1), 'ba' + 'b' * n, 'bba' + 'a' * n]
+    return [('BLOWUP', '(a|b)*a' + '(a|b)' * n), ('SPACE', '\\ ')], [word + ' ' for word in words]
+
+
+SPECS: dict[str, Callable[[int], tuple[list[tuple[str, str]], list[str]]]] = {
+    'keywords': keywords,
+    'nested_stars': nested_stars,
+    'char_classes': char_classes,
+    'blowup': blowup,
+}
+DEFAULT_SPECS = ['keywords:10', 'keywords:200', 'nested_stars:8', 'char_classes:16', 'blowup:8', 'blowup:12']
+
+
+def generate_input(words: list[str], size: int, seed: int = SEED) -> str:
+    # a text of at most size characters made of whole random words. a block of random words is generated once and
+    # repeated, so very large inputs are cheap to build
+    rng = random.Random(seed)
+    block = []
+    length = 0
+    while length < min(size, 1 << 16):
+        word = rng.choice(words)
+        block.append(word)
+        length += len(word)
+
+    # fill the rest with the first words of the block that still fit
+    text = ''.join(block) * (size // length)
+    rest = size - len(text)
+    tail = []
+    for word in block:
+        if len(word) > rest:
+            break
+        tail.append(word)
+        rest -= len(word)
+
+    return text + ''.join(tail)
+
+
+def parse_size(size: str) -> int:
+    # a size like 100, 64K or 200M
+    size = size.strip().upper()
+    if size[-1] in UNITS:
+        return int(float(size[:-1]) * UNITS[size[-1]])
+    return int(size)
+
+
+# measurement
+
+def measure(f: Callable[[], object], repeat: int, memory: bool) -> tuple[float, int | None, object]:
+    # the best time of repeat calls of f, the peak memory allocated by one more call (tracked separately, as tracemalloc
+    # slows the code down), and the result of the last call
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = perf_counter()
+        result = f()
+        best = min(best, perf_counter() - start)
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        f()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return best, peak, result
+
+
+def run_spec(name: str, param: int, sizes: list[int], repeat: int, memory: bool) -> list[dict]:
+    # benchmark every stage on one generated spec, and lexing on inputs of every size
+    spec, words = SPECS[name](param)
+    label = f'{name}:{param}'
+    results = []
+
+    def record(stage: str, seconds: float, peak: int | None, size: int | None = None, **counts) -> None:
+        result = {'spec': label, 'stage': stage, 'seconds': seconds, 'peak_bytes': peak}
+        if size is not None:
+            result['size'] = size
+            result['mb_per_s'] = size / (1 << 20) / seconds if seconds else None
+        result.update(counts)
+        results.append(result)
+
+    seconds, peak, regexes = measure(lambda: [parse_regex(regex) for _, regex in spec], repeat, memory)
+    record('parse', seconds, peak)
+
+    seconds, peak, nfas = measure(lambda: [regex.thompson() for regex in regexes], repeat, memory)
+    record('thompson', seconds, peak, nfa_states=sum(len(nfa.K) for nfa in nfas))
+
+    # the determinization and minimization stages run on the nfa of the whole lexer, as built by Lexer
+    lexer = Lexer(spec)
+    seconds, peak, dfa = measure(lexer.nfa.subset_construction, repeat, memory)
+    record('subset_construction', seconds, peak, nfa_states=len(lexer.nfa.K), dfa_states=len(dfa.K))
+
+    seconds, peak, minimal = measure(dfa.minimize, repeat, memory)
+    record('minimize', seconds, peak, dfa_states=len(minimal.K))
+
+    seconds, peak, _ = measure(lambda: Lexer(spec), repeat, memory)
+    record('lexer_build', seconds, peak, dfa_states=len(lexer.compiled.accepts), classes=lexer.compiled.n_classes)
+
+    # accept runs on single words, with the tables of the dfa already compiled
+    rng = random.Random(SEED)
+    sample = [rng.choice(words).strip() or ' ' for _ in range(10000)]
+    minimal.accept('')
+    seconds, peak, accepted = measure(lambda: sum(map(minimal.accept, sample)), repeat, memory)
+    record('accept', seconds, peak, sum(map(len, sample)), accepted=accepted)
+
+    for size in sizes:
+        text = generate_input(words, size)
+
+        seconds, peak, tokens = measure(lambda: lexer.lex(text), repeat, memory)
+        record('lex', seconds, peak, size, tokens=len(tokens))
+
+        seconds, peak, tokens = measure(lambda: lexer.lex_compact(text), repeat, memory)
+        record('lex_compact', seconds, peak, size, tokens=len(tokens))
+
+    return results
+
+
+# baselines
+
+def key(result: dict) -> tuple:
+    return result['spec'], result['stage'], result.get('size')
+
+
+def compare(results: list[dict], baseline: list[dict], threshold: float, min_seconds: float) -> list[str]:
+    # the stages that are more than threshold times slower than in the baseline. stages that took less than
+    # min_seconds in the baseline are too noisy to be compared, so they only get their ratio
+    previous = {key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get(key(result))
+        if old is None or not old['seconds']:
+            continue
+
+        ratio = result['seconds'] / old['seconds']
+        result['baseline_seconds'] = old['seconds']
+        result['ratio'] = ratio
+        if ratio > threshold and old['seconds'] >= min_seconds:
+            size = f" ({result['size']} chars)" if 'size' in result else ''
+            regressions.append(f"{result['spec']} {result['stage']}{size}: {old['seconds']:.6f}s -> "
+                               f"{result['seconds']:.6f}s ({ratio:.2f}x)")
+
+    return regressions
+
+
+def report(results: list[dict]) -> str:
+    header = f"{'spec':<18}{'stage':<21}{'size':>11}{'seconds':>12}{'peak KiB':>11}{'MB/s':>9}{'states':>9}{'ratio':>7}"
+    lines = [header, '-' * len(header)]
+    for result in results:
+        states = result.get('dfa_states', result.get('nfa_states', ''))
+        peak = '' if result['peak_bytes'] is None else f"{result['peak_bytes'] / 1024:.0f}"
+        mb_per_s = f"{result['mb_per_s']:.2f}" if result.get('mb_per_s') else ''
+        ratio = f"{result['ratio']:.2f}" if 'ratio' in result else ''
+        lines.append(f"{result['spec']:<18}{result['stage']:<21}{result.get('size', ''):>11}"
+                     f"{result['seconds']:>12.6f}{peak:>11}{mb_per_s:>9}{states:>9}{ratio:>7}")
+
+    return '\n'.join(lines)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = ArgumentParser(description='benchmark the stages of the lexer')
+    parser.add_argument('--specs', nargs='+', default=DEFAULT_SPECS,
+                        help=f"specs to run, as name:parameter, with name one of {', '.join(SPECS)}")
+    parser.add_argument('--sizes', nargs='+', default=['1K', '64K', '1M'],
+                        help='sizes of the lexed inputs in characters, like 100, 64K or 200M')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs, the best one is kept')
+    parser.add_argument('--no-memory', action='store_true', help='skip the (slower) peak memory measurements')
+    parser.add_argument('--save', metavar='PATH', help='save the results as a json baseline')
+    parser.add_argument('--compare', metavar='PATH', help='compare the results with a saved baseline')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='slowdown against the baseline that counts as a regression')
+    parser.add_argument('--min-seconds', type=float, default=0.001,
+                        help='stages faster than this in the baseline are not checked for regressions')
+    args = parser.parse_args(argv)
+
+    sizes = [parse_size(size) for size in args.sizes]
+    results = []
+    for spec in args.specs:
+        name, _, param = spec.partition(':')
+        if name not in SPECS:
+            parser.error(f'unknown spec {name!r}')
+        results += run_spec(name, int(param or 1), sizes, args.repeat, not args.no_memory)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file)['results'], args.threshold, args.min_seconds)
+
+    print(report(results))
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(), 'results': results},
+                      file, indent=1)
+
+    if regressions:
+        print(f'\n{len(regressions)} regression(s) over {args.threshold:.2f}x:')
+        print('\n'.join(regressions))
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
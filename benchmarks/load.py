@@ -0,0 +1,194 @@
+"""Load generator for the lexing server: many clients sending lexing requests at once, reporting throughput and
+latency percentiles on the client side, and the counters of the server.
+
+Run it from the root of the repository:
+
+    python benchmarks/load.py                               # start a server on localhost and load it
+    python benchmarks/load.py --clients 32 --size 1M        # more clients, larger texts
+    python -m src.Server --port 8765 &
+    python benchmarks/load.py --port 8765                   # load a server that is already running
+
+The specs and texts are generated like in bench.py, from the keywords spec with a different number of keywords for
+every spec, so that --specs above the capacity of the server exercises its lexer pool. Only the standard library is
+needed.
+"""
+from argparse import ArgumentParser
+from collections.abc import Iterable
+from contextlib import aclosing
+from time import perf_counter, sleep
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench import generate_input, keywords, parse_size
+from src.Client import Client, ServerError
+from src.Lexer import Lexer
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+async def run_client(host: str, port: int, jobs: Iterable[tuple[list[tuple[str, str]], str]], skip: list[str],
+                     deadline: float | None, latencies: list[float], counts: dict[str, int]) -> None:
+    # send the jobs one after the other on one connection, until they are all done or the deadline passed
+    async with await Client.connect(host, port) as client:
+        for spec, text in jobs:
+            if deadline is not None and perf_counter() > deadline:
+                return
+
+            start = perf_counter()
+            try:
+                tokens = 0
+                async with aclosing(client.stream(spec, text, skip)) as batches:
+                    async for batch in batches:
+                        if batch and batch[0][0] == "":
+                            counts['errors'] += 1
+                            break
+                        tokens += len(batch)
+            except ServerError:
+                counts['errors'] += 1
+                continue
+
+            latencies.append(perf_counter() - start)
+            counts['requests'] += 1
+            counts['chars'] += len(text)
+            counts['tokens'] += tokens
+
+
+def wait_for_server(host: str, port: int, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    # wait until the server accepts connections
+    start = perf_counter()
+    while perf_counter() - start < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f'the server exited with status {process.returncode}')
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            sleep(0.1)
+    raise RuntimeError(f'the server did not start listening on {host}:{port} in {timeout} seconds')
+
+
+def free_port(host: str) -> int:
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+async def load(args, specs: list[tuple[list[tuple[str, str]], str]]) -> dict:
+    # run the clients, each with its share of the requests spread over the specs
+    latencies = []
+    counts = {'requests': 0, 'errors': 0, 'chars': 0, 'tokens': 0}
+    deadline = perf_counter() + args.duration if args.duration else None
+    requests = args.requests if not args.duration else 1 << 62
+
+    # a first request for every spec, so the time to compile them is not counted in the latencies
+    async with await Client.connect(args.host, args.port) as client:
+        for spec, text in specs:
+            if args.check:
+                expected = Lexer(spec, skip=args.skip).lex(text)
+                if await client.lex(spec, text, args.skip) != expected:
+                    raise RuntimeError(f'the server and Lexer.lex disagree on the spec {spec[:3]}...')
+            else:
+                await client.lex(spec, text[:100], args.skip)
+
+    def jobs(k: int):
+        for i in range(requests):
+            yield specs[(k + i) % len(specs)]
+
+    start = perf_counter()
+    await asyncio.gather(*(run_client(args.host, args.port, jobs(k), args.skip, deadline, latencies, counts)
+                           for k in range(args.clients)))
+    seconds = perf_counter() - start
+
+    async with await Client.connect(args.host, args.port) as client:
+        server = await client.stats()
+
+    return {
+        'clients': args.clients,
+        'size': args.size,
+        'specs': len(specs),
+        'seconds': seconds,
+        **counts,
+        'requests_per_second': counts['requests'] / seconds,
+        'mb_per_second': counts['chars'] / seconds / 1e6,
+        'tokens_per_second': counts['tokens'] / seconds,
+        'latency_p50': percentile(latencies, 0.5),
+        'latency_p90': percentile(latencies, 0.9),
+        'latency_p99': percentile(latencies, 0.99),
+        'latency_max': max(latencies, default=0.0),
+        'server': server,
+    }
+
+
+def report(result: dict) -> str:
+    lines = [f"{result['clients']} clients, {result['specs']} specs, texts of {result['size']} characters, "
+             f"{result['seconds']:.2f} seconds",
+             f"requests    {result['requests']:>12} ({result['errors']} errors)",
+             f"requests/s  {result['requests_per_second']:>12.1f}",
+             f"MB/s        {result['mb_per_second']:>12.2f}",
+             f"tokens/s    {result['tokens_per_second']:>12.0f}"]
+    for name in ('p50', 'p90', 'p99', 'max'):
+        lines.append(f"latency {name:<4}{result[f'latency_{name}'] * 1000:>12.2f} ms")
+
+    server = result['server']
+    lines.append(f"server: {server['lexers']} lexers in the pool, {server['lexer_hits']} hits, "
+                 f"{server['lexer_misses']} misses, {server['lexer_evictions']} evictions, "
+                 f"p99 latency {server['latency_p99'] * 1000:.2f} ms")
+    return '\n'.join(lines)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = ArgumentParser(description='load a lexing server with concurrent clients')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=None, help='port of a running server (default: start one)')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes of the started server')
+    parser.add_argument('--capacity', type=int, default=64, help='lexers kept by the started server')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent connections')
+    parser.add_argument('--requests', type=int, default=50, help='requests sent by every client')
+    parser.add_argument('--duration', type=float, default=None,
+                        help='send requests for this many seconds instead of a fixed number')
+    parser.add_argument('--size', default='64K', help='size of the lexed texts, like 100, 64K or 10M')
+    parser.add_argument('--specs', type=int, default=4, help='number of different specs')
+    parser.add_argument('--skip', nargs='*', default=[], help='tokens left out of the answers, like SPACE')
+    parser.add_argument('--check', action='store_true', help='check the answers against Lexer.lex first')
+    parser.add_argument('--json', action='store_true', help='print the results as json')
+    args = parser.parse_args(argv)
+    args.size = parse_size(args.size)
+
+    specs = []
+    for i in range(args.specs):
+        spec, words = keywords(10 + i)
+        specs.append((spec, generate_input(words, args.size, seed=i)))
+
+    process = None
+    if args.port is None:
+        args.port = free_port(args.host)
+        command = [sys.executable, '-m', 'src.Server', '--host', args.host, '--port', str(args.port),
+                   '--capacity', str(args.capacity)]
+        if args.workers:
+            command += ['--workers', str(args.workers)]
+        process = subprocess.Popen(command, cwd=ROOT)
+        wait_for_server(args.host, args.port, process)
+
+    try:
+        result = asyncio.run(load(args, specs))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    print(json.dumps(result, indent=1) if args.json else report(result))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,88 @@
+from array import array
+from collections.abc import Iterable
+from typing import NamedTuple
+
+from .CompiledDFA import RANGE_EXPANSION
+
+MAX_CHAR = 0x10FFFF  # the last unicode code point
+
+
+class CharRange(NamedTuple):
+    # a transition label matching every character between lo and hi (both included).
+    # single characters are labeled with the character itself, ranges are only used for two or more characters
+    lo: str
+    hi: str
+
+
+def label(lo: int, hi: int) -> str | CharRange:
+    # the label of the code points between lo and hi
+    return chr(lo) if lo == hi else CharRange(chr(lo), chr(hi))
+
+
+def bounds(symbol: str | CharRange) -> tuple[int, int]:
+    # the first and last code point matched by a label
+    if isinstance(symbol, CharRange):
+        return ord(symbol.lo), ord(symbol.hi)
+    return ord(symbol), ord(symbol)
+
+
+def atoms(labels: Iterable[str | CharRange]) -> list[str | CharRange]:
+    # split the labels into the smallest disjoint pieces, so that every label is the union of some of them.
+    # the pieces are sorted by their first code point
+    labels = list(labels)
+    cuts = set()
+    for symbol in labels:
+        lo, hi = bounds(symbol)
+        cuts.add(lo)
+        cuts.add(hi + 1)
+
+    # sweep over the cuts, counting how many labels cover each piece between two cuts
+    events = {}
+    for symbol in labels:
+        lo, hi = bounds(symbol)
+        events[lo] = events.get(lo, 0) + 1
+        events[hi + 1] = events.get(hi + 1, 0) - 1
+
+    pieces = []
+    covered = 0
+    cuts = sorted(cuts)
+    for start, end in zip(cuts, cuts[1:]):
+        covered += events.get(start, 0)
+        if covered:
+            pieces.append(label(start, end - 1))
+
+    return pieces
+
+
+def complement(ranges: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    # the code point ranges not covered by the given ones
+    result = []
+    start = 0
+    for lo, hi in sorted(ranges):
+        if lo > start:
+            result.append((start, lo - 1))
+        start = max(start, hi + 1)
+
+    if start <= MAX_CHAR:
+        result.append((start, MAX_CHAR))
+
+    return result
+
+
+def atom_classes(pieces: list[str | CharRange]) -> tuple[dict[str, int], array, array, array]:
+    # the symbol classes of a list of atoms, in the form used by CompiledDFA: the class of every atom is its index + 1
+    # (class 0 is left for the symbols that are not in the alphabet). the characters of small atoms are listed one by
+    # one, the larger atoms are kept as ranges with their first and last code point
+    classes = {}
+    starts, ends, range_classes = array('l'), array('l'), array('i')
+    for atom, piece in enumerate(pieces):
+        lo, hi = bounds(piece)
+        if hi - lo < RANGE_EXPANSION:
+            for code in range(lo, hi + 1):
+                classes[chr(code)] = atom + 1
+        else:
+            starts.append(lo)
+            ends.append(hi)
+            range_classes.append(atom + 1)
+
+    return classes, starts, ends, range_classes
@@ -0,0 +1,119 @@
+from collections.abc import Sequence
+
+from .CompiledDFA import CompiledDFA, UNKNOWN
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed by the batch dfa
+    np = None
+
+LOOKUP_SIZE = 0x10000  # the classes of the code points below this are looked up in a dense array
+
+
+class BatchDFA:
+    # runs a compiled dfa over many words at once with numpy: the words are encoded as one flat array of symbol
+    # classes, and all of them advance by one symbol at each step with a single lookup in the transition matrix.
+    # the words are sorted by length, so at step j only the words longer than j are looked at, without padding
+
+    def __init__(self, compiled: CompiledDFA) -> None:
+        if np is None:
+            raise ImportError('BatchDFA needs numpy')
+        if not isinstance(compiled.classes, dict):
+            raise ValueError('BatchDFA needs a dfa over characters')
+
+        self.q0 = compiled.q0
+        self.n_classes = compiled.n_classes
+        self.table = np.frombuffer(compiled.table, dtype=np.int32)
+        self.accepts = np.frombuffer(compiled.accepts, dtype=np.int32)
+        self.starts = np.array(compiled.starts, dtype=np.int64)
+        self.ends = np.array(compiled.ends, dtype=np.int64)
+        self.range_classes = np.array(compiled.range_classes, dtype=np.int32)
+
+        # the classes of the first LOOKUP_SIZE code points (and of any character listed in the dfa above them) are
+        # kept in a dense array indexed by code point, the classes of the larger code points are found by bisection
+        size = max(LOOKUP_SIZE, max(map(ord, compiled.classes), default=-1) + 1)
+        self.lookup = self.range_class(np.arange(size, dtype=np.int64))
+        for char, cls in compiled.classes.items():
+            self.lookup[ord(char)] = cls
+
+    def range_class(self, codes: 'np.ndarray') -> 'np.ndarray':
+        # the classes of code points that are not listed in the classes of the dfa
+        classes = np.full(len(codes), UNKNOWN, dtype=np.int32)
+        if len(self.starts):
+            found = np.searchsorted(self.starts, codes, side='right') - 1
+            inside = np.flatnonzero((found >= 0) & (codes <= self.ends[found]))
+            classes[inside] = self.range_classes[found[inside]]
+
+        return classes
+
+    def encode(self, words: Sequence[str]) -> tuple['np.ndarray', 'np.ndarray', 'np.ndarray']:
+        # the symbol classes of all the words, one after the other, with the offset and length of every word
+        lengths = np.fromiter(map(len, words), dtype=np.int64, count=len(words))
+        offsets = np.zeros(len(words), dtype=np.int64)
+        np.cumsum(lengths[:-1], out=offsets[1:])
+
+        codes = np.frombuffer(''.join(words).encode('utf-32-le'), dtype=np.uint32)
+        classes = self.lookup[np.minimum(codes, len(self.lookup) - 1)]
+
+        # the code points above the dense array are looked up in the ranges
+        above = np.flatnonzero(codes >= len(self.lookup))
+        if len(above):
+            classes[above] = self.range_class(codes[above].astype(np.int64))
+
+        return classes, offsets, lengths
+
+    def run(self, words: Sequence[str], positions: Sequence[int] | None, longest: bool) \
+            -> tuple['np.ndarray', 'np.ndarray', 'np.ndarray']:
+        # run the dfa over every word (from its position, if given) to its end. returns the state every word ends in,
+        # and if longest is set, the last token accepted along the way and where its match ends
+        classes, offsets, lengths = self.encode(words)
+        if positions is not None:
+            positions = np.asarray(positions, dtype=np.int64)
+            offsets += positions
+            lengths -= positions
+
+        order = np.argsort(-lengths, kind='stable')
+        offsets, lengths = offsets[order], lengths[order]
+        states = np.full(len(words), self.q0, dtype=np.int32)
+        tokens = np.full(len(words), -1, dtype=np.int32)
+        base = np.zeros(len(words), dtype=np.int64) if positions is None else positions[order]
+        ends = base.copy()
+
+        # the number of words still running shrinks as the shorter ones end, or all the rest die
+        active = len(words)
+        step = 0
+        while active:
+            while active and lengths[active - 1] <= step:
+                active -= 1
+            if not active:
+                break
+
+            states[:active] = self.table[states[:active] * self.n_classes + classes[offsets[:active] + step]]
+            step += 1
+
+            if longest:
+                accepted = self.accepts[states[:active]]
+                found = np.flatnonzero(accepted >= 0)
+                tokens[found] = accepted[found]
+                ends[found] = base[found] + step
+
+            if not states[:active].any():   # every word is in the dead state
+                break
+
+        # put the results back in the order of the words
+        inverse = np.empty_like(order)
+        inverse[order] = np.arange(len(order))
+        return states[inverse], tokens[inverse], ends[inverse]
+
+    def accept(self, words: Sequence[str]) -> 'np.ndarray':
+        # check every word, returning an array of bools
+        states, _, _ = self.run(words, None, False)
+        return self.accepts[states] >= 0
+
+    def longest_prefix(self, words: Sequence[str], positions: Sequence[int] | None = None) \
+            -> tuple['np.ndarray', 'np.ndarray']:
+        # find the longest non-empty match in every word, starting at its position (0 if not given), like
+        # CompiledDFA.match. returns the arrays of tokens and match ends, with -1 and the position for no match.
+        # a lexer can find the next token of many words at once by calling it again from the ends of the matches
+        _, tokens, ends = self.run(words, positions, True)
+        return tokens, ends
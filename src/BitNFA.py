@@ -0,0 +1,97 @@
+from typing import TYPE_CHECKING
+
+from .Alphabet import atom_classes
+from .CompiledDFA import CompiledDFA, UNKNOWN
+
+if TYPE_CHECKING:
+    from .NFA import NFA
+
+CHUNK = 8  # the state sets are split in chunks of this many bits, each with a table of the moves of its values
+
+
+class BitNFA:
+    # simulates a nfa directly, without building a dfa. the set of active states is kept as the bits of an int, and the
+    # states reached on a symbol are found by splitting that int in bytes and or-ing together the moves of every byte,
+    # looked up in a table of each atom. the moves of a byte are computed the first time they are needed, so building
+    # the simulator only costs the epsilon closures of the nfa
+
+    def __init__(self, nfa: 'NFA') -> None:
+        closures = {}
+        pieces, moves = nfa.atom_moves(closures)
+        self.classes, self.starts, self.ends, self.range_classes = atom_classes(pieces)
+
+        # every state gets a bit, and the moves of every state are turned into masks of the states they reach
+        bits = {state: i for i, state in enumerate(nfa.K)}
+        mask = lambda states: sum(1 << bits[state] for state in states)
+        self.moves = [{} for _ in bits]
+        for state, state_moves in moves.items():
+            self.moves[bits[state]] = {atom + 1: mask(reached) for atom, reached in state_moves.items()}
+
+        self.q0 = mask(nfa.closure(nfa.q0, closures))
+        self.finals = mask(nfa.F)
+        self.n_bytes = (len(bits) + CHUNK - 1) // CHUNK
+        self.tables = {}  # for every class, the moves of every byte of every chunk: tables[cls][chunk][byte]
+
+    # the classes are looked up the same way as in a compiled dfa
+    symbol_class = CompiledDFA.symbol_class
+
+    def step(self, active: int, cls: int) -> int:
+        # the states reached from the active ones on a class
+        if cls == UNKNOWN:
+            return 0
+
+        table = self.tables.get(cls)
+        if table is None:
+            table = self.tables[cls] = [{} for _ in range(self.n_bytes)]
+
+        reached = 0
+        for chunk, byte in enumerate(active.to_bytes(self.n_bytes, 'little')):
+            if byte:
+                targets = table[chunk].get(byte)
+                if targets is None:
+                    targets = table[chunk][byte] = self.byte_moves(chunk, byte, cls)
+                reached |= targets
+
+        return reached
+
+    def byte_moves(self, chunk: int, byte: int, cls: int) -> int:
+        # the states reached on a class from the states of one byte of the state set
+        reached = 0
+        for bit in range(CHUNK):
+            if byte >> bit & 1:
+                reached |= self.moves[chunk * CHUNK + bit].get(cls, 0)
+
+        return reached
+
+    def match_longest(self, word: str, pos: int = 0) -> int:
+        # the end of the longest match starting at pos (pos itself if only the empty word matches), or -1
+        classes, symbol_class, step, finals = self.classes, self.symbol_class, self.step, self.finals
+        active = self.q0
+        end = pos if active & finals else -1
+
+        while pos < len(word) and active:
+            cls = classes.get(word[pos])
+            if cls is None:
+                cls = symbol_class(word[pos])
+
+            active = step(active, cls)
+            pos += 1
+            if active & finals:
+                end = pos
+
+        return end
+
+    def accept(self, word: str) -> bool:
+        classes, symbol_class, step = self.classes, self.symbol_class, self.step
+        active = self.q0
+
+        for symbol in word:
+            cls = classes.get(symbol)
+            if cls is None:
+                cls = symbol_class(symbol)
+
+            active = step(active, cls)
+            if not active:
+                return False
+
+        return bool(active & self.finals)
@@ -0,0 +1,94 @@
+from src.Server import DEFAULT_PORT, LINE_LIMIT
+from collections.abc import AsyncIterator, Iterable
+from contextlib import aclosing
+import asyncio
+import json
+
+
+class ServerError(ValueError):
+    # an error answered by the server to an invalid request
+    pass
+
+
+class Client:
+    # a connection to a lexing server. the requests are sent one at a time, each waiting for the answer of the last
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.next_id = 0
+        self.lock = asyncio.Lock()
+
+    @classmethod
+    async def connect(cls, host: str = '127.0.0.1', port: int = DEFAULT_PORT) -> 'Client':
+        reader, writer = await asyncio.open_connection(host, port, limit=LINE_LIMIT)
+        return cls(reader, writer)
+
+    async def close(self) -> None:
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    async def __aenter__(self) -> 'Client':
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def request(self, message: dict) -> AsyncIterator[dict]:
+        # send a request and yield the lines of its answer, up to the last one. the connection is locked until the
+        # generator is closed, so it must be iterated in aclosing when the iteration can stop early
+        async with self.lock:
+            message['id'] = self.next_id
+            self.next_id += 1
+            self.writer.write(json.dumps(message).encode('utf-8') + b'\n')
+            await self.writer.drain()
+
+            done = False
+            try:
+                while not done:
+                    line = await self.reader.readline()
+                    if not line:
+                        raise ConnectionError('the server closed the connection')
+
+                    answer = json.loads(line)
+                    done = 'tokens' not in answer
+                    if 'error' in answer:
+                        raise ServerError(answer['error'])
+                    yield answer
+            except GeneratorExit:
+                # the rest of an answer left before its end is read, so the next request doesn't get its lines
+                while not done and (line := await self.reader.readline()):
+                    done = 'tokens' not in json.loads(line)
+                raise
+
+    async def stream(self, spec: list[tuple[str, str]], text: str, skip: Iterable[str] = ()) \
+            -> AsyncIterator[list[tuple[str, str]]]:
+        # the tokens of the text, in the batches the server sends them in. if the text can't be lexed, the last batch
+        # is [("", message)] like the result of Lexer.lex
+        message = {'spec': [list(rule) for rule in spec], 'text': text, 'skip': list(skip)}
+        async with aclosing(self.request(message)) as answers:
+            async for answer in answers:
+                if 'tokens' in answer:
+                    yield [(token, lexeme) for token, lexeme in answer['tokens']]
+                elif 'lex_error' in answer:
+                    yield [("", answer['lex_error'])]
+
+    async def lex(self, spec: list[tuple[str, str]], text: str, skip: Iterable[str] = ()) -> list[tuple[str, str]]:
+        # the tokens of the text, the same as Lexer(spec, skip=skip).lex(text) gives
+        matches = []
+        async with aclosing(self.stream(spec, text, skip)) as batches:
+            async for batch in batches:
+                if batch and batch[0][0] == "":
+                    return batch
+                matches.extend(batch)
+
+        return matches
+
+    async def stats(self) -> dict:
+        # the counters of the server
+        async with aclosing(self.request({'stats': True})) as answers:
+            async for answer in answers:
+                return answer['stats']
@@ -0,0 +1,202 @@
+from array import array
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from typing import Any, BinaryIO
+import json
+import re
+import struct
+import sys
+
+DEAD = 0  # state 0 is the dead state of every compiled dfa: no final state can be reached from it
+UNKNOWN = 0  # class 0 groups every symbol that is not in the alphabet of the dfa
+RANGE_EXPANSION = 256  # ranges of at most this many characters have each character listed in the classes
+
+# binary format of dumped tables: magic, format version, length of a json header, the json header and the raw tables
+MAGIC = b'LFAD'
+FORMAT_VERSION = 2
+PREFIX = struct.Struct('<4sHI')
+
+
+@dataclass
+class CompiledDFA:
+    classes: dict[str, int] | list[int]  # map from every symbol of the alphabet to its symbol class (list for bytes)
+    n_classes: int
+    q0: int
+    table: array  # flat transition table, the target of (state, class) is at table[state * n_classes + class]
+    accepts: array  # accepts[state] is the id of the token accepted in that state, or -1 if it is not final
+    # larger ranges of characters in the alphabet, as their first and last code points and their class, sorted
+    starts: array = field(default_factory=lambda: array('l'))
+    ends: array = field(default_factory=lambda: array('l'))
+    range_classes: array = field(default_factory=lambda: array('i'))
+    # for every state with a transition to itself, the match method of a regex matching a run of the characters it
+    # loops on (None for the other states). it is built from the tables, and only for dfas over characters
+    runs: list = field(default=None, init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        if isinstance(self.classes, dict):
+            self.runs = self.build_runs()
+
+    def build_runs(self) -> list:
+        # the regexes of the states looping on some characters, as character sets of the code points of their classes
+        n = self.n_classes
+        class_ranges = {}
+        for symbol, cls in self.classes.items():
+            class_ranges.setdefault(cls, []).append((ord(symbol), ord(symbol)))
+        for lo, hi, cls in zip(self.starts, self.ends, self.range_classes):
+            class_ranges.setdefault(cls, []).append((lo, hi))
+
+        runs = []
+        for state in range(len(self.accepts)):
+            loop = sorted(r for cls in range(1, n) if self.table[state * n + cls] == state and state != DEAD
+                          for r in class_ranges.get(cls, ()))
+            if not loop:
+                runs.append(None)
+                continue
+
+            ranges = []
+            for lo, hi in loop:
+                if ranges and lo <= ranges[-1][1] + 1:
+                    ranges[-1] = (ranges[-1][0], max(ranges[-1][1], hi))
+                else:
+                    ranges.append((lo, hi))
+            charset = ''.join(re.escape(chr(lo)) if lo == hi else f'{re.escape(chr(lo))}-{re.escape(chr(hi))}'
+                              for lo, hi in ranges)
+            runs.append(re.compile(f'[{charset}]*').match)
+
+        return runs
+
+    def accept(self, word: str) -> bool:
+        # simulate the compiled dfa on the given word, using only index lookups
+        table, classes, n, symbol_class = self.table, self.classes, self.n_classes, self.symbol_class
+        state = self.q0
+
+        for symbol in word:
+            cls = classes.get(symbol)
+            if cls is None:
+                cls = symbol_class(symbol)
+
+            state = table[state * n + cls]
+            if state == DEAD:
+                return False
+
+        return self.accepts[state] >= 0
+
+    def symbol_class(self, symbol: str) -> int:
+        # the class of a symbol, looking it up in the ranges if it is not listed in the classes
+        cls = self.classes.get(symbol)
+        if cls is not None:
+            return cls
+
+        code = ord(symbol)
+        i = bisect_right(self.starts, code) - 1
+        if i >= 0 and code <= self.ends[i]:
+            return self.range_classes[i]
+
+        return UNKNOWN
+
+    def known(self, symbol: str) -> bool:
+        # check if the symbol is part of the alphabet of the dfa
+        return self.symbol_class(symbol) != UNKNOWN
+
+    def scan(self, word: str, pos: int, end: int, state: int, token: int = -1, match_end: int = -1) \
+            -> tuple[int, int, int, int]:
+        # run the dfa from the given state over word[pos:end], until it dies or the end is reached.
+        # returns the state it stopped in, the position it stopped at (the symbol there was not consumed if the dfa
+        # died on it) and the last token accepted along the way together with the position where its match ends.
+        # in a state looping on some characters, the whole run of them is skipped at once with its regex
+        table, classes, accepts, n, runs = self.table, self.classes, self.accepts, self.n_classes, self.runs
+        symbol_class = self.symbol_class
+
+        while pos < end:
+            cls = classes.get(word[pos])
+            if cls is None:
+                cls = symbol_class(word[pos])
+
+            state = table[state * n + cls]
+            if state == DEAD:
+                break
+
+            pos += 1
+            run = runs[state]
+            if run is not None:
+                pos = run(word, pos, end).end()
+            if accepts[state] >= 0:
+                token = accepts[state]
+                match_end = pos
+
+        return state, pos, token, match_end
+
+    def scan_bytes(self, data: bytes | memoryview, pos: int, end: int, state: int, token: int = -1,
+                   match_end: int = -1) -> tuple[int, int, int, int]:
+        # same as scan, but over bytes. classes must be a list with the class of each of the 256 byte values
+        table, classes, accepts, n = self.table, self.classes, self.accepts, self.n_classes
+
+        while pos < end:
+            state = table[state * n + classes[data[pos]]]
+            if state == DEAD:
+                break
+
+            pos += 1
+            if accepts[state] >= 0:
+                token = accepts[state]
+                match_end = pos
+
+        return state, pos, token, match_end
+
+    def match(self, word: str, pos: int) -> tuple[int, int]:
+        # find the longest non-empty match starting at pos. returns the token and the end of the match, or -1 and pos
+        _, _, token, match_end = self.scan(word, pos, len(word), self.q0, -1, pos)
+        return token, match_end
+
+    def dump(self, file: BinaryIO, extra: dict[str, Any] | None = None) -> None:
+        # write the tables to a binary file, extra is stored in the header and given back by load
+        header = json.dumps({
+            'symbols': ''.join(self.classes),
+            'classes': list(self.classes.values()),
+            'n_classes': self.n_classes,
+            'q0': self.q0,
+            'n_states': len(self.accepts),
+            'ranges': list(zip(self.starts, self.ends, self.range_classes)),
+            'extra': extra or {},
+        }).encode('utf-8')
+
+        file.write(PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+        file.write(header)
+        for table in (self.table, self.accepts):
+            if sys.byteorder == 'big':
+                table = array('i', table)
+                table.byteswap()
+            file.write(table.tobytes())
+
+    @staticmethod
+    def load(file: BinaryIO) -> tuple['CompiledDFA', dict[str, Any]]:
+        # read tables written by dump. raises ValueError if the file is not in the current format
+        prefix = file.read(PREFIX.size)
+        if len(prefix) != PREFIX.size:
+            raise ValueError('truncated compiled dfa')
+
+        magic, version, length = PREFIX.unpack(prefix)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f'unsupported compiled dfa format (version {version})')
+
+        header = json.loads(file.read(length).decode('utf-8'))
+        if not isinstance(header, dict) or not isinstance(header.get('extra'), dict):
+            raise ValueError('malformed compiled dfa header')
+
+        tables = []
+        for size in (header['n_states'] * header['n_classes'], header['n_states']):
+            table = array('i')
+            data = file.read(size * table.itemsize)
+            if len(data) != size * table.itemsize:
+                raise ValueError('truncated compiled dfa')
+
+            table.frombytes(data)
+            if sys.byteorder == 'big':
+                table.byteswap()
+            tables.append(table)
+
+        starts, ends, range_classes = zip(*header['ranges']) if header['ranges'] else ((), (), ())
+        compiled = CompiledDFA(classes=dict(zip(header['symbols'], header['classes'])), n_classes=header['n_classes'],
+                               q0=header['q0'], table=tables[0], accepts=tables[1], starts=array('l', starts),
+                               ends=array('l', ends), range_classes=array('i', range_classes))
+        return compiled, header['extra']
@@ -1,31 +1,97 @@
-from collections.abc import Callable
-from dataclasses import dataclass
+from array import array
+from collections.abc import Callable, Hashable
+from dataclasses import dataclass, field
 from itertools import product
 # import pandas as pd
 from typing import TypeVar
 from functools import reduce
 
+from .Alphabet import CharRange, bounds
+from .CompiledDFA import CompiledDFA, DEAD, RANGE_EXPANSION
+
 STATE = TypeVar('STATE')
 OTHER_STATE = TypeVar('OTHER_STATE')
 
 
 @dataclass
 class DFA[STATE]:
-    S: set[str]
+    S: set[str | CharRange]
     K: set[STATE]
     q0: STATE
-    d: dict[tuple[STATE, str], STATE]
+    d: dict[tuple[STATE, str | CharRange], STATE]
     F: set[STATE]
+    # compiled tables used by accept, built on the first call (the dfa should not be changed afterwards)
+    compiled: CompiledDFA | None = field(default=None, init=False, repr=False, compare=False)
 
     def accept(self, word: str) -> bool:
         # simulate the dfa on the given word. return true if the dfa accepts the word, false otherwise
-        current_state = self.q0
-        for symbol in word:
-            if (current_state, symbol) in self.d:
-                current_state = self.d[(current_state, symbol)]
+        if self.compiled is None:
+            self.compiled = self.compile()
+
+        return self.compiled.accept(word)
+
+    def compile(self, token: Callable[[STATE], int] | None = None) -> CompiledDFA:
+        # number the states as small ints and store the transitions in a flat table of symbol classes.
+        # token gives the id accepted in each state (-1 for states that are not final), by default 0 for final states
+        if token is None:
+            token = lambda state: 0 if state in self.F else -1
+
+        # find the states from which a final state can still be reached, the others all become the dead state
+        predecessors = {}
+        for (state, symbol), target in self.d.items():
+            predecessors.setdefault(target, set()).add(state)
+
+        alive = set(self.F)
+        stack = list(self.F)
+        while stack:
+            for state in predecessors.get(stack.pop(), ()):
+                if state not in alive:
+                    alive.add(state)
+                    stack.append(state)
+
+        # number the reachable live states in bfs order from the initial state, 0 is kept for the dead state
+        alphabet = sorted(self.S, key=bounds)
+        number = {}
+        order = []
+        if self.q0 in alive:
+            number[self.q0] = 1
+            order.append(self.q0)
+
+        for state in order:
+            for symbol in alphabet:
+                target = self.d.get((state, symbol))
+                if target in alive and target not in number:
+                    number[target] = len(order) + 1
+                    order.append(target)
+
+        # symbols with the same column in the transition table are merged into one class, class 0 is left for
+        # the symbols that are not in the alphabet. the characters of small ranges are listed one by one
+        columns = {}
+        classes = {}
+        starts, ends, range_classes = array('l'), array('l'), array('i')
+        for symbol in alphabet:
+            column = tuple(number.get(self.d.get((state, symbol)), DEAD) for state in order)
+            cls = columns.setdefault(column, len(columns) + 1)
+
+            lo, hi = bounds(symbol)
+            if hi - lo < RANGE_EXPANSION:
+                for code in range(lo, hi + 1):
+                    classes[chr(code)] = cls
             else:
-                return False
-        return current_state in self.F
+                starts.append(lo)
+                ends.append(hi)
+                range_classes.append(cls)
+
+        n_classes = len(columns) + 1
+        table = array('i', [DEAD]) * ((len(order) + 1) * n_classes)
+        for column, cls in columns.items():
+            for i, target in enumerate(column):
+                table[(i + 1) * n_classes + cls] = target
+
+        accepts = array('i', [-1] + [token(state) for state in order])
+
+        return CompiledDFA(classes=classes, n_classes=n_classes, q0=number.get(self.q0, DEAD), table=table,
+                           accepts=accepts, starts=starts, ends=ends, range_classes=range_classes)
 
     def remap_states[OTHER_STATE](self, f: Callable[[STATE], 'OTHER_STATE']) -> 'DFA[OTHER_STATE]':
         # Remap states, initial state, and final states
@@ -54,47 +120,82 @@ class DFA[STATE]:
         #                   \-a,b-/
 
 
-    def minimize(self) -> 'DFA[STATE]':
-        self = self.remap_states(lambda x: x)
-        states = list(self.K)
-
-        matrix = [[0 for _ in range(len(self.K))] for _ in range(len(self.K))]
-        stack = []
-
-        for i in range(len(self.K)):
-            for j in range(i):
-                if (states[i] in self.F and states[j] not in self.F) or (states[i] not in self.F and states[j] in self.F):
-                    matrix[i][j] = 1
-                    stack.append((i, j))
+    def minimize(self, partition: Callable[[STATE], Hashable] | None = None) -> 'DFA[STATE]':
+        # hopcroft's partition refinement. states start in the same block when partition gives them the same key (by
+        # default, whether they are final), and blocks are split until all their states behave the same.
+        # every block is then replaced by one of its states
+        if partition is None:
+            partition = lambda state: state in self.F
 
-        while stack:
-            i, j = stack.pop()
-
-            for symbol in self.S:
-                predecessors_i = set()
-                predecessors_j = set()
-
-                for state in self.K:
-                    if self.d.get((state, symbol)) == states[i]:
-                        predecessors_i.add(state)
-                    if self.d.get((state, symbol)) == states[j]:
-                        predecessors_j.add(state)
-
-                if predecessors_i != set() and predecessors_j != set():
-                    for state_i in predecessors_i:
-                        for state_j in predecessors_j:
-                            if matrix[states.index(state_i)][states.index(state_j)] == 0 or matrix[states.index(state_j)][
-                                states.index(state_i)] == 0:
-                                matrix[states.index(state_i)][states.index(state_j)] = 1
-                                matrix[states.index(state_j)][states.index(state_i)] = 1
-                                stack.append((states.index(state_i), states.index(state_j)))
-
-        # if two states are equivalent, we keep only one of them, renaiming the other to the name of the first one
-        state_mapping = {state: state for state in states}
-        for i in range(len(self.K)):
-            for j in range(i):
-                if matrix[i][j] == 0:
-                    state_mapping[states[j]] = state_mapping[states[i]]
+        states = list(self.K)
+        index = {state: i for i, state in enumerate(states)}
+        symbols = list(self.S)
+        dead = len(states)  # stands for the missing transitions, only used if there are any
+
+        # reverse transitions: for every symbol, the states that go to each state on it
+        inverse = [{} for _ in symbols]
+        missing = False
+        for i, state in enumerate(states):
+            for a, symbol in enumerate(symbols):
+                target = self.d.get((state, symbol))
+                if target is None:
+                    missing = True
+                    target = dead
+                else:
+                    target = index[target]
+                inverse[a].setdefault(target, []).append(i)
+
+        if missing:
+            for a in range(len(symbols)):
+                inverse[a].setdefault(dead, []).append(dead)
+
+        # the initial blocks
+        keys = {}
+        blocks = []
+        block_of = [0] * (dead + 1)
+        for i, state in enumerate(states):
+            block = keys.setdefault(partition(state), len(keys))
+            if block == len(blocks):
+                blocks.append(set())
+            blocks[block].add(i)
+            block_of[i] = block
+
+        if missing:
+            block_of[dead] = len(blocks)
+            blocks.append({dead})
+
+        work = list(range(len(blocks)))
+        while work:
+            splitter = blocks[work.pop()]
+
+            for a in range(len(symbols)):
+                # the states that go into the splitter on this symbol, grouped by their block
+                touched = {}
+                for target in splitter:
+                    for source in inverse[a].get(target, ()):
+                        touched.setdefault(block_of[source], []).append(source)
+
+                for block, inside in touched.items():
+                    if len(inside) == len(blocks[block]):
+                        continue
+
+                    # split the block. the smaller part gets a new block and is added to the work list, which is
+                    # enough even if the block was already waiting there, as it keeps the larger part
+                    inside = set(inside)
+                    outside = blocks[block] - inside
+                    smaller, larger = (inside, outside) if len(inside) <= len(outside) else (outside, inside)
+
+                    blocks[block] = larger
+                    blocks.append(smaller)
+                    for i in smaller:
+                        block_of[i] = len(blocks) - 1
+                    work.append(len(blocks) - 1)
+
+        # every state is renamed to the first state of its block
+        representative = {}
+        state_mapping = {}
+        for i, state in enumerate(states):
+            state_mapping[state] = representative.setdefault(block_of[i], state)
 
         # Create new sets of states, transitions, and final states
         new_K = set(state_mapping.values())
@@ -105,4 +206,3 @@ class DFA[STATE]:
             new_d[(state_mapping[state], symbol)] = state_mapping[target]
 
         return DFA(S=self.S, K=new_K, q0=new_q0, d=new_d, F=new_F)
-
@@ -0,0 +1,202 @@
+from .CompiledDFA import CompiledDFA, DEAD, UNKNOWN
+
+# the code shared by every generated lexer: only the tables at the top and the match function differ
+TEMPLATE = '''\
+# generated from a lexer spec, do not edit
+from bisect import bisect_right
+
+TOKENS = {tokens!r}
+KEYWORDS = {keywords!r}
+SKIP = {skip!r}  # the ids of the tokens left out of the result of lex
+# the first and last code points of the ranges of characters in the alphabet
+ALPHABET_STARTS = {starts!r}
+ALPHABET_ENDS = {ends!r}
+
+
+def match(word: str, pos: int) -> tuple[int, int]:
+    # find the longest non-empty match starting at pos. returns the token and the end of the match, or -1 and pos
+    length = len(word)
+    token = -1
+    end = pos
+    state = {q0}
+{match_body}
+    return token, end
+
+
+def known(symbol: str) -> bool:
+    code = ord(symbol)
+    i = bisect_right(ALPHABET_STARTS, code) - 1
+    return i >= 0 and code <= ALPHABET_ENDS[i]
+
+
+def error(word: str, pos: int) -> str:
+    line = word.count('\\n', 0, pos)
+    column = pos - word.rfind('\\n', 0, pos) - 1
+    if not known(word[pos]):
+        return f"No viable alternative at character {{column}}, line {{line}}"
+    if pos == len(word) - 1:
+        return f"No viable alternative at character EOF, line {{line}}"
+    return f"No viable alternative at character {{column + 1}}, line {{line}}"
+
+
+def lex(word: str) -> list[tuple[str, str]]:
+    # the loop of match is repeated here, to save a call for every token
+    matches = []
+    start = 0
+    length = len(word)
+
+    while start < length:
+        pos = start
+        token = -1
+        end = pos
+        state = {q0}
+{lex_body}
+        if token < 0:
+            return [("", error(word, start))]
+
+        lexeme = word[start:end]
+        keyword = KEYWORDS.get(lexeme)
+        if keyword is not None and keyword < token:
+            token = keyword
+        if token not in SKIP:
+            matches.append((TOKENS[token], lexeme))
+        start = end
+
+    return matches
+'''
+
+
+def export_lexer(compiled: CompiledDFA, tokens: list[str], keywords: dict[str, int],
+                 skip: frozenset[int] = frozenset()) -> str:
+    # the source of a python module lexing like a lexer with these tables, without needing this package. every state
+    # of the dfa gets its own branch testing the next character against the ranges of each of its transitions, and
+    # the branch of a state is found by a binary search on the state number. a state looping on some characters
+    # consumes all of them in a tight loop before looking at the other transitions
+    ranges = class_ranges(compiled)
+    n_states = len(compiled.accepts)
+
+    # the transitions of every state, as the code point ranges leading to each target
+    transitions = []
+    for state in range(n_states):
+        targets = {}
+        for cls in range(1, compiled.n_classes):
+            target = compiled.table[state * compiled.n_classes + cls]
+            if target != DEAD:
+                targets.setdefault(target, []).extend(ranges.get(cls, []))
+        transitions.append({target: merge(target_ranges) for target, target_ranges in targets.items()})
+
+    alphabet = merge([r for cls_ranges in ranges.values() for r in cls_ranges])
+    return TEMPLATE.format(tokens=list(tokens), keywords=dict(keywords), skip=set(skip),
+                           starts=[lo for lo, _ in alphabet], ends=[hi for _, hi in alphabet], q0=compiled.q0,
+                           match_body=scan_loop(transitions, compiled, 1), lex_body=scan_loop(transitions, compiled, 2))
+
+
+def scan_loop(transitions: list[dict], compiled: CompiledDFA, depth: int) -> str:
+    # the loop running the dfa from pos, leaving the last accepted token and the end of its match in token and end
+    if compiled.q0 == DEAD:
+        return ''
+
+    indent = '    ' * depth
+    lines = [f'{indent}while pos < length:', f'{indent}    c = word[pos]']
+    # every match starts in the initial state, so it is tested first, before the search over the other states
+    others = [state for state in range(1, len(compiled.accepts)) if state != compiled.q0]
+    if others:
+        lines += [f'{indent}    if state == {compiled.q0}:']
+        lines += state_code(compiled.q0, transitions[compiled.q0], compiled.accepts, depth + 2)
+        lines += [f'{indent}    else:']
+        lines += dispatch(others, transitions, compiled.accepts, depth + 2)
+    else:
+        lines += state_code(compiled.q0, transitions[compiled.q0], compiled.accepts, depth + 1)
+    lines += [f'{indent}    pos += 1']
+    return '\n'.join(lines)
+
+
+def class_ranges(compiled: CompiledDFA) -> dict[int, list[tuple[int, int]]]:
+    # the code point ranges of every class of a compiled dfa
+    ranges = {}
+    for char, cls in compiled.classes.items():
+        if cls != UNKNOWN:
+            ranges.setdefault(cls, []).append((ord(char), ord(char)))
+    for lo, hi, cls in zip(compiled.starts, compiled.ends, compiled.range_classes):
+        ranges.setdefault(cls, []).append((lo, hi))
+
+    return ranges
+
+
+def merge(ranges: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    # sort the ranges and merge the ones that overlap or touch
+    merged = []
+    for lo, hi in sorted(ranges):
+        if merged and lo <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+        else:
+            merged.append((lo, hi))
+
+    return merged
+
+
+def condition(ranges: list[tuple[int, int]], var: str) -> str:
+    # a python expression testing if the character in var is in one of the ranges. single characters (and ranges of
+    # two) are tested together with one membership test on a string
+    singles = ''
+    tests = []
+    for lo, hi in ranges:
+        if hi - lo < 2:
+            singles += ''.join(chr(code) for code in range(lo, hi + 1))
+        else:
+            tests.append(f'{chr(lo)!r} <= {var} <= {chr(hi)!r}')
+
+    if len(singles) == 1:
+        tests.insert(0, f'{var} == {singles!r}')
+    elif singles:
+        tests.insert(0, f'{var} in {singles!r}')
+
+    return ' or '.join(tests)
+
+
+def dispatch(states: list[int], transitions: list[dict], accepts, depth: int) -> list[str]:
+    # the branches of the given states, found by comparing the state number with the middle one
+    indent = '    ' * depth
+    if len(states) == 1:
+        return state_code(states[0], transitions[states[0]], accepts, depth)
+
+    middle = len(states) // 2
+    return ([f'{indent}if state < {states[middle]}:'] + dispatch(states[:middle], transitions, accepts, depth + 1) +
+            [f'{indent}else:'] + dispatch(states[middle:], transitions, accepts, depth + 1))
+
+
+def state_code(state: int, targets: dict[int, list[tuple[int, int]]], accepts, depth: int) -> list[str]:
+    # the code of one state: c is the character at pos, and the code either moves to the next state (pos is moved
+    # past c after it) or leaves the loop if there is no transition on c
+    indent = '    ' * depth
+    lines = []
+
+    loop = targets.get(state)
+    targets = {target: ranges for target, ranges in targets.items() if target != state}
+    if loop is not None:
+        # consume the characters of the loop at once, the state accepts at each of them if it is final
+        lines += [f'{indent}while {condition(loop, "c")}:',
+                  f'{indent}    pos += 1',
+                  f'{indent}    if pos == length:',
+                  f'{indent}        break',
+                  f'{indent}    c = word[pos]']
+        if accepts[state] >= 0:
+            lines += [f'{indent}if pos > end:',
+                      f'{indent}    token = {accepts[state]}',
+                      f'{indent}    end = pos']
+        if targets:
+            lines += [f'{indent}if pos == length:', f'{indent}    break']
+
+    keyword = 'if'
+    for target, ranges in targets.items():
+        lines += [f'{indent}{keyword} {condition(ranges, "c")}:', f'{indent}    state = {target}']
+        if accepts[target] >= 0:
+            lines += [f'{indent}    token = {accepts[target]}', f'{indent}    end = pos + 1']
+        keyword = 'elif'
+
+    if targets:
+        lines += [f'{indent}else:', f'{indent}    break']
+    else:
+        lines += [f'{indent}break']
+
+    return lines
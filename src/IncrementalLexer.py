@@ -0,0 +1,208 @@
+from src.Lexer import Lexer, error
+from array import array
+from bisect import bisect_right
+from collections.abc import Callable, Iterator
+
+BLOCK_SIZE = 512  # the tokens are kept in blocks of at most this many tokens
+
+
+class TokenBlock:
+    # a run of consecutive tokens: their ids, their lengths, and how many characters the dfa looked at to find each of
+    # them (from the start of the token to the character the dfa died on, included, or to one past the end of the text)
+    __slots__ = ('ids', 'lengths', 'looks', 'size')
+
+    def __init__(self, ids: array, lengths: array, looks: array) -> None:
+        self.ids = ids
+        self.lengths = lengths
+        self.looks = looks
+        self.size = sum(lengths)  # the number of characters covered by the tokens
+
+
+class IncrementalLexer:
+    # keeps the tokens of a text while it is edited, lexing again only around the edits. a token only depends on the
+    # characters the dfa looked at to find it, so the tokens before an edit that didn't look at it are kept, and
+    # lexing restarts at the first one that did. once a new token ends where an old token after the edit started, the
+    # rest of the old tokens are kept too.
+    # the tokens are stored as their lengths in blocks, so an edit only changes the blocks around it and the start
+    # offsets of the blocks, instead of the offsets of every token after it
+
+    def __init__(self, lexer: Lexer, text: str = "") -> None:
+        self.lexer = lexer
+        self.text = text
+        self.blocks = []
+        self.block_starts = []  # the offset in the text where every block starts
+        self.block_firsts = []  # the index of the first token of every block
+        self.count = 0  # the number of tokens
+        self.error_pos = None  # the position where lexing failed, if it did (the tokens stop there)
+        self.max_look = 0  # an upper bound on the looks of all the tokens
+
+        ids, lengths, looks, self.error_pos = self.scan(0, None)
+        self.replace(0, 0, ids, lengths, looks)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def spans(self) -> Iterator[tuple[int, int, int]]:
+        # the (token id, start, end) of every token
+        for block, start in zip(self.blocks, self.block_starts):
+            for token, length in zip(block.ids, block.lengths):
+                yield token, start, start + length
+                start += length
+
+    def tokens(self) -> list[tuple[str, str]]:
+        # the tokens of the text, in the same form as Lexer.lex gives them. the skipped tokens are kept in the blocks
+        # like the others, as the edits need them to resync, and only left out here
+        if self.error_pos is not None:
+            return [("", self.error())]
+        names, skip = self.lexer.tokens, self.lexer.skip
+        return [(names[token], self.text[start:end]) for token, start, end in self.spans() if token not in skip]
+
+    def error(self) -> str | None:
+        # the message of the lexing error of the text. it is built when asked for, as its line and column change with
+        # the edits before it
+        if self.error_pos is None:
+            return None
+        return error(self.lexer.compiled, self.text, self.error_pos)
+
+    def edit(self, offset: int, deleted: int, inserted: str) -> tuple[int, int, int]:
+        # replace the deleted characters at offset with the inserted text, and update the tokens. returns the index of
+        # the first token that changed, the number of old tokens removed from there and the number of new tokens that
+        # replaced them
+        if offset < 0 or deleted < 0 or offset + deleted > len(self.text):
+            raise ValueError(f'cannot delete {deleted} characters at {offset} in a text of {len(self.text)}')
+
+        self.text = self.text[:offset] + inserted + self.text[offset + deleted:]
+        delta = len(inserted) - deleted
+        first, start = self.restart(offset)
+
+        # lex again from the first token that looked at the edit, until a new token ends where an old token after the
+        # edit started: from there on, the text and so the tokens are the same as before
+        old_starts = self.starts(first, start)
+        old_start = next(old_starts, None)
+        removed = 0
+        resynced = False
+
+        def synced(end: int) -> bool:
+            nonlocal old_start, removed, resynced
+            if end < offset + len(inserted):
+                return False
+            while old_start is not None and old_start < end - delta:
+                old_start = next(old_starts, None)
+                removed += 1
+            resynced = old_start == end - delta
+            return resynced
+
+        ids, lengths, looks, error_pos = self.scan(start, synced)
+
+        if resynced:
+            if self.error_pos is not None:
+                self.error_pos += delta
+        else:
+            # the new tokens went on to the end of the text or to an error, so they replace all the old ones
+            removed = len(self) - first
+            self.error_pos = error_pos
+
+        self.replace(first, removed, ids, lengths, looks)
+        return first, removed, len(ids)
+
+    def restart(self, offset: int) -> tuple[int, int]:
+        # the index and the start of the first token that looked at the character at offset (or at the end of the
+        # text, if offset is there). if there is none, the index and position after the last token
+        first = self.count
+        start = self.block_starts[-1] + self.blocks[-1].size if self.blocks else 0
+
+        # the blocks starting after offset only have tokens that looked at it, so they are skipped as a whole
+        block_index = bisect_right(self.block_starts, offset)
+        if block_index < len(self.blocks):
+            first, start = self.block_firsts[block_index], self.block_starts[block_index]
+
+        for block_index in range(block_index - 1, -1, -1):
+            block = self.blocks[block_index]
+            token_start = self.block_starts[block_index] + block.size
+
+            for i in range(len(block.ids) - 1, -1, -1):
+                token_start -= block.lengths[i]
+                if token_start + self.max_look <= offset:
+                    # no token starting here or before can have looked that far
+                    return first, start
+
+                if token_start + block.looks[i] > offset:
+                    first = self.block_firsts[block_index] + i
+                    start = token_start
+
+        return first, start
+
+    def locate(self, index: int) -> tuple[int, int]:
+        # the block of the token with the given index, and the index of the token in the block
+        if index >= self.count:
+            return len(self.blocks), 0
+
+        block_index = bisect_right(self.block_firsts, index) - 1
+        return block_index, index - self.block_firsts[block_index]
+
+    def starts(self, first: int, start: int) -> Iterator[int]:
+        # the starts of the tokens from the one with index first, which starts at start
+        block_index, i = self.locate(first)
+        for block in self.blocks[block_index:]:
+            for length in block.lengths[i:]:
+                yield start
+                start += length
+            i = 0
+
+    def scan(self, start: int, synced: Callable[[int], bool] | None) -> tuple[array, array, array, int | None]:
+        # lex the text from start, until the end of the text, an error, or the end of a token for which synced is
+        # true. returns the ids, lengths and looks of the new tokens, and the position of the error if there was one
+        compiled, keyword, text = self.lexer.compiled, self.lexer.keyword, self.text
+        scan, q0 = compiled.scan, compiled.q0
+        ids, lengths, looks = array('i'), array('l'), array('l')
+        pos = start
+        length = len(text)
+
+        while pos < length:
+            _, stop, token, end = scan(text, pos, length, q0, -1, pos)
+            if token < 0:
+                return ids, lengths, looks, pos
+
+            ids.append(keyword(token, text[pos:end]))
+            lengths.append(end - pos)
+            looks.append(stop - pos + 1)
+            pos = end
+
+            if synced is not None and synced(end):
+                break
+
+        return ids, lengths, looks, None
+
+    def replace(self, first: int, removed: int, ids: array, lengths: array, looks: array) -> None:
+        # replace the removed tokens from the index first with new ones. the blocks they are in are split again into
+        # new blocks, and the blocks after them get their starts and first indices counted again
+        block_index, i = self.locate(first)
+        last_index, j = self.locate(first + removed)
+
+        if block_index < len(self.blocks):
+            block = self.blocks[block_index]
+            ids, lengths, looks = block.ids[:i] + ids, block.lengths[:i] + lengths, block.looks[:i] + looks
+            start = self.block_starts[block_index]
+        else:
+            start = self.block_starts[-1] + self.blocks[-1].size if self.blocks else 0
+
+        if last_index < len(self.blocks):
+            block = self.blocks[last_index]
+            ids, lengths, looks = ids + block.ids[j:], lengths + block.lengths[j:], looks + block.looks[j:]
+            last_index += 1
+
+        self.max_look = max(self.max_look, max(looks, default=0))
+        self.blocks[block_index:last_index] = [
+            TokenBlock(ids[k:k + BLOCK_SIZE], lengths[k:k + BLOCK_SIZE], looks[k:k + BLOCK_SIZE])
+            for k in range(0, len(ids), BLOCK_SIZE)
+        ]
+
+        count = first - i
+        del self.block_starts[block_index:], self.block_firsts[block_index:]
+        for block in self.blocks[block_index:]:
+            self.block_starts.append(start)
+            self.block_firsts.append(count)
+            start += block.size
+            count += len(block.ids)
+
+        self.count = count
@@ -0,0 +1,166 @@
+from collections import OrderedDict
+
+from .Alphabet import atom_classes
+from .CompiledDFA import CompiledDFA, DEAD, UNKNOWN
+from .NFA import NFA
+
+THRASH_WINDOW = 4096  # the number of characters over which the misses of the cache are counted
+THRASH_RATIO = 10  # the cache thrashes when it misses a state more than once every this many characters
+
+
+class LazyState:
+    # a dfa state built by LazyDFA: its subset of nfa states, the token it accepts, the subsets it goes to on each
+    # class that was already seen from it, and a flag telling if it was used since the last eviction round
+    __slots__ = ('subset', 'token', 'next', 'used')
+
+    def __init__(self, subset: frozenset, token: int):
+        self.subset = subset
+        self.token = token
+        self.next = {}
+        self.used = True
+
+
+class LazyDFA:
+    # a dfa built on the fly from a nfa, while scanning. states are only built when the input first reaches them, and
+    # at most max_states of them are kept, evicting the least recently used ones (approximated with a second chance
+    # clock). the cache is bounded by its number of states rather than by their size in memory. the states the full
+    # cache misses are counted over windows of THRASH_WINDOW characters, across scans: when it misses too many, the
+    # cache is thrashing, and the nfa is simulated directly until a window misses few enough of them again.
+    # it can be used in place of a CompiledDFA, but its states are subsets of nfa states instead of ints (DEAD is
+    # still 0)
+
+    def __init__(self, nfa: NFA, finals: dict, max_states: int = 10000) -> None:
+        # finals maps the final states of the nfa to the id of the token they accept
+        if max_states < 1:
+            raise ValueError(f'a lazy dfa must keep at least 1 state, not {max_states}')
+
+        self.finals = finals
+        self.max_states = max_states
+        self.closures = {}
+        pieces, self.moves = nfa.atom_moves(self.closures)
+        self.q0 = nfa.closure(nfa.q0, self.closures)
+        self.cache = OrderedDict()
+        self.evictions = 0
+        self.thrashing = False
+        self.steps = 0  # the characters scanned in the current window
+        self.misses = 0  # the states missing from the full cache in the current window
+
+        # the class of every atom is its index + 1, class 0 is left for the symbols that are not in the alphabet
+        self.classes, self.starts, self.ends, self.range_classes = atom_classes(pieces)
+
+    # the classes are looked up the same way as in a compiled dfa
+    symbol_class = CompiledDFA.symbol_class
+    known = CompiledDFA.known
+
+    def state(self, subset: frozenset) -> LazyState:
+        # get the cached state of a subset, building it if needed
+        entry = self.cache.get(subset)
+        if entry is None:
+            if len(self.cache) >= self.max_states:
+                self.evict()
+                self.misses += 1
+
+            token = min((self.finals[state] for state in subset if state in self.finals), default=-1)
+            entry = self.cache[subset] = LazyState(subset, token)
+
+        return entry
+
+    def evict(self) -> None:
+        # evict the oldest state that was not used since it was last looked at, giving the others a second chance
+        while True:
+            subset, entry = self.cache.popitem(last=False)
+            if not entry.used:
+                break
+
+            entry.used = False
+            self.cache[subset] = entry
+
+        self.evictions += 1
+
+    def step(self, subset: frozenset, cls: int) -> frozenset:
+        # simulate the nfa: the subset reached from the given one on a class
+        if cls == UNKNOWN:
+            return frozenset()
+
+        reached = set()
+        for state in subset:
+            target = self.moves.get(state, {}).get(cls - 1)
+            if target:
+                reached |= target
+
+        return frozenset(reached)
+
+    def scan(self, word: str, pos: int, end: int, state: frozenset | int, token: int = -1, match_end: int = -1) \
+            -> tuple[frozenset | int, int, int, int]:
+        # same as CompiledDFA.scan
+        if state == DEAD:
+            return state, pos, token, match_end
+
+        classes, symbol_class, cache = self.classes, self.symbol_class, self.cache
+        steps, thrashing = self.steps, self.thrashing
+        entry = None if thrashing else self.state(state)
+
+        while pos < end:
+            if steps == THRASH_WINDOW:
+                thrashing = self.end_window()
+                steps = 0
+                entry = None if thrashing else self.state(state)
+            steps += 1
+
+            cls = classes.get(word[pos])
+            if cls is None:
+                cls = symbol_class(word[pos])
+
+            if thrashing:
+                # simulate the nfa, only counting the states that the cache would have to build
+                subset = self.step(state, cls)
+                if not subset:
+                    state = DEAD
+                    break
+                if subset not in cache:
+                    self.misses += 1
+
+                state = subset
+                pos += 1
+                found = min((self.finals[s] for s in subset if s in self.finals), default=-1)
+                if found >= 0:
+                    token = found
+                    match_end = pos
+                continue
+
+            subset = entry.next.get(cls)
+            if subset is None:
+                subset = entry.next[cls] = self.step(entry.subset, cls)
+            if not subset:
+                state = DEAD
+                break
+
+            entry = self.state(subset)
+            entry.used = True
+            state = subset
+            pos += 1
+            if entry.token >= 0:
+                token = entry.token
+                match_end = pos
+
+        self.steps = steps
+        return state, pos, token, match_end
+
+    def end_window(self) -> bool:
+        # tell if the cache thrashed over the window that just ended, and start the next one
+        self.thrashing = self.misses * THRASH_RATIO > THRASH_WINDOW
+        self.misses = 0
+        return self.thrashing
+
+    def match(self, word: str, pos: int) -> tuple[int, int]:
+        # same as CompiledDFA.match
+        _, _, token, match_end = self.scan(word, pos, len(word), self.q0, -1, pos)
+        return token, match_end
+
+    def accept(self, word: str) -> bool:
+        # simulate the dfa on the given word, building the states it reaches
+        if not word:
+            return self.state(self.q0).token >= 0
+
+        state, _, _, match_end = self.scan(word, 0, len(word), self.q0)
+        return state != DEAD and match_end == len(word)
@@ -1,84 +1,698 @@
 from src.Regex import Regex, parse_regex
 from src.NFA import NFA
+from src.CompiledDFA import CompiledDFA, DEAD, FORMAT_VERSION
+from src.LazyDFA import LazyDFA
+from src.Export import export_lexer
+from src.Stats import LexerStats
+from src.Tokens import TokenBatch, Tokens
+from src.UTF8 import utf8_dfa
+from array import array
+from bisect import bisect_left
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import contextmanager, suppress
 from functools import reduce
+from itertools import repeat
+from time import perf_counter
+from typing import IO, BinaryIO, TextIO
+import codecs
+import hashlib
+import json
+import mmap
+import os
+import tempfile
 
 EPSILON = ''
 
+# source files whose code decides what a spec compiles to, hashed into the keys of cached lexers
+SOURCES = ['Alphabet.py', 'Regex.py', 'NFA.py', 'BitNFA.py', 'DFA.py', 'LazyDFA.py', 'CompiledDFA.py', 'Lexer.py']
+
 class Lexer:
-    def __init__(self, spec: list[tuple[str, str]]) -> None:
+    def __init__(self, spec: list[tuple[str, str]], cache_dir: str | os.PathLike | None = None, lazy: bool = False,
+                 max_states: int = 10000, stats: bool = False, skip: Iterable[str] | None = None) -> None:
+        self.tokens = [token for token, _ in spec]  # map from token ids (the index in the spec) to token names
+        # the ids of the tokens (like spaces or comments) that are matched but left out of the results
+        skip = set(skip or ())
+        if skip - set(self.tokens):
+            raise ValueError(f"unknown tokens to skip: {', '.join(sorted(skip - set(self.tokens)))}")
+        self.skip = frozenset(i for i, token in enumerate(self.tokens) if token in skip)
+        self.compiled_bytes = None  # the dfa over utf-8 bytes used by lex_bytes, built on first use
+        # if stats is set, the cost of the build and of every call of lex is counted in a LexerStats
+        self.stats = LexerStats() if stats else None
+
+        # in lazy mode, only the nfa is built, and the dfa states are built while lexing, keeping at most max_states
+        if lazy:
+            self.build(spec, lazy=True, max_states=max_states)
+            return
+
+        # if a cache directory is given, load the compiled tables from it when the spec was already compiled before
+        path = None
+        if cache_dir is not None:
+            path = os.path.join(cache_dir, cache_key(spec) + '.lfa')
+            if self.load(path):
+                if self.stats is not None:
+                    self.stats.cached = True
+                    self.count_tables()
+                return
+
+        self.build(spec)
+
+        # the cache only saves time: if the tables can't be written there, the lexer built here is still used
+        if path is not None:
+            try:
+                self.save(path)
+            except OSError:
+                pass
+
+    def build(self, spec: list[tuple[str, str]], lazy: bool = False, max_states: int = 10000) -> None:
+        stats = self.stats
+        start_time = perf_counter() if stats else 0.0
+
         # build a nfa that will contain the nfa of each token
-        self.nfa = NFA(set(), set(), 0, {(0, EPSILON): set()}, set())
-        self.nfa.K.add(0)
-        self.nfa.q0 = 0 # there will be one starting state that leads to the starting states of the nfa of each token
-        self.nfa.F = set()
+        self.nfa = NFA(set(), set(), 0, {}, set())
+        self.nfa.q0 = self.nfa.new_state() # there will be one starting state that leads to the starting states of the nfa of each token
         self.final_states = {}  # map from final states of the nfa to the token they represent
-        offset = 1
 
-        # transform every lexeme into a nfa and add it to the nfa of the lexer
+        # build the nfa of every lexeme directly into the nfa of the lexer. rules that are plain words (keywords,
+        # operators) are kept aside, as chains of states for them would make the dfa much larger
+        literals = []
         for i in range(len(spec)):
             regex = parse_regex(spec[i][1])
-            nfa = regex.thompson().remap_states(lambda x: x + offset)
+            if regex.literal() is not None:
+                literals.append((regex.literal(), i))
+                continue
+
+            size = len(self.nfa.K)
+            start, final = regex.build(self.nfa)
+            if stats:
+                stats.rule_states[spec[i][0]] = len(self.nfa.K) - size
+            self.nfa.add_transition(self.nfa.q0, EPSILON, start)
+            self.nfa.F.add(final)
+
+            # map the final state of the nfa of the token to the token
+            self.final_states[final] = (spec[i][0], i)
+
+        # a word matched by another rule (like a keyword matched by the identifier rule) doesn't need states of its own:
+        # the other rule already finds the longest match, and the lexeme is looked up in the keywords afterwards to get
+        # the first token of the spec matching it
+        self.keywords = {}
+        others = LazyDFA(self.nfa, {s: i for s, (_, i) in self.final_states.items()})
+        trie = []
+        for word, i in literals:
+            if others.accept(word):
+                self.keywords.setdefault(word, i)
+            else:
+                trie.append((word, i))
+
+        # the other words go into a trie, so words with the same prefix share states
+        size = len(self.nfa.K)
+        if trie:
+            root = self.nfa.new_state()
+            self.nfa.add_transition(self.nfa.q0, EPSILON, root)
+
+            for word, i in trie:
+                state = root
+                for char in word:
+                    targets = self.nfa.d.get((state, char))
+                    if targets:
+                        state = next(iter(targets))
+                    else:
+                        target = self.nfa.new_state()
+                        self.nfa.add_transition(state, char, target)
+                        state = target
+
+                self.nfa.F.add(state)
+                self.final_states.setdefault(state, (spec[i][0], i))
+
+        if stats:
+            for word, i in literals:
+                stats.rule_states.setdefault(spec[i][0], 0)
+            stats.rule_states['trie'] = len(self.nfa.K) - size
+            stats.nfa_states = len(self.nfa.K)
+            stats.nfa_transitions = sum(map(len, self.nfa.d.values()))
+            stats.keywords = len(self.keywords)
+            start_time = self.stamp('thompson', start_time)
+
+        if lazy:
+            self.dfa = None
+            self.compiled = LazyDFA(self.nfa, {s: i for s, (_, i) in self.final_states.items()}, max_states)
+            return
 
-            offset += len(nfa.K)
+        # every state of the dfa accepts the first token in the spec among the final states of the nfa it contains
+        token = lambda state: min((self.final_states[s][1] for s in state if s in self.final_states), default=-1)
 
-            # add the nfa of the token to the nfa of the lexer
-            self.nfa.S.update(nfa.S)
-            self.nfa.K.update(nfa.K)
-            self.nfa.d[(0, EPSILON)].add(nfa.q0)
-            self.nfa.d.update(nfa.d)
-            self.nfa.F.update(nfa.F)
+        # transform the nfa of the lexer into a dfa, and minimize it. states are only merged if they accept the same
+        # token, so the final_states still give the right token for every state
+        closures = {}
+        dfa = self.nfa.subset_construction(closures)
+        if stats:
+            stats.closures = len(closures)
+            stats.subset_states = len(dfa.K)
+            start_time = self.stamp('subset_construction', start_time)
 
-            # for every final state of the nfa of the token, map it to the token
-            for s in nfa.F:
-                self.final_states[s] = (spec[i][0], i)
+        self.dfa = dfa.minimize(token)
+        if stats:
+            start_time = self.stamp('minimize', start_time)
 
-        # transform the nfa of the lexer into a dfa
-        # minimizing would mess up the final_states, so we don't do it
-        self.dfa = self.nfa.subset_construction()
+        # compile the dfa into integer tables
+        self.compiled = self.dfa.compile(token)
+        if stats:
+            self.stamp('compile', start_time)
+            self.count_tables()
 
+    def stamp(self, stage: str, start_time: float) -> float:
+        # add the time since start_time to the build time of a stage, and return the current time
+        now = perf_counter()
+        self.stats.build_seconds[stage] = self.stats.build_seconds.get(stage, 0.0) + now - start_time
+        return now
+
+    def count_tables(self) -> None:
+        # count the states, transitions and classes of the compiled tables in the stats
+        compiled = self.compiled
+        self.stats.dfa_states = len(compiled.accepts)
+        self.stats.dfa_transitions = len(compiled.table) - compiled.table.count(DEAD)
+        self.stats.symbol_classes = compiled.n_classes
+
+    def load(self, path: str | os.PathLike) -> bool:
+        # load the compiled tables saved at path. the nfa and the dfa are not saved, so they are left as None.
+        # returns false if there is no usable file at path
+        try:
+            with open(path, 'rb') as file:
+                compiled, extra = CompiledDFA.load(file)
+        except (OSError, ValueError, KeyError, TypeError):
+            # a file that is missing, from another version or malformed in any way is only a cache miss
+            return False
+
+        if extra.get('tokens') != self.tokens or not isinstance(extra.get('keywords', {}), dict):
+            return False
+
+        self.nfa = None
+        self.dfa = None
+        self.final_states = {}
+        self.keywords = extra.get('keywords', {})
+        self.compiled = compiled
+        return True
+
+    def save(self, path: str | os.PathLike) -> None:
+        # save the compiled tables to path, with atomic_write so processes loading it never see it half written
+        with atomic_write(path, 'wb') as file:
+            self.compiled.dump(file, {'tokens': self.tokens, 'keywords': self.keywords})
+
+    def export(self, path: str | os.PathLike) -> None:
+        # write a standalone python module with lex and match functions working like the ones of this lexer, which
+        # can be imported without this package and without building anything
+        if not isinstance(self.compiled, CompiledDFA):
+            raise ValueError('exporting needs the compiled tables, which are not built in lazy mode')
+
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(export_lexer(self.compiled, self.tokens, self.keywords, self.skip))
 
     def lex(self, word: str) -> list[tuple[str, str]] | None:
+        if self.stats is not None:
+            return self.lex_counted(word)
+
         matches = []
         pos = 0
+        length = len(word)
+        scan, q0, tokens, keywords, skip = self.compiled.scan, self.compiled.q0, self.tokens, self.keywords, self.skip
+        longest = max(map(len, keywords), default=0) if skip else 0
 
-        # simulate the dfa on the given word
-        while pos < len(word):
-            current_state = self.dfa.q0
-            token = ""
-            best_match = ""
-            remaining = word[pos:]
-            built = ""
-
-            # until we reach a final state (followed by sink), keep consuming characters
-            while current_state:
-                # if we reach a final state, save the token and the match
-                if current_state in self.dfa.F:
-                    final_states = set(self.final_states) & current_state
-                    token = self.final_states[min(final_states)][0]
-                    best_match = built
-
-                if remaining:
-                    current_state = self.dfa.d.get((current_state, remaining[0]))
-                    built += remaining[0]
-                    remaining = remaining[1:]
-                # if the word was consumed, break
-                else:
-                    break
+        # simulate the dfa on the given word, one token at a time. the dfa runs until it dies, remembering the last
+        # position where it accepted, and the lexeme is cut out with a single slice
+        while pos < length:
+            _, _, token, end = scan(word, pos, length, q0, -1, pos)
 
-            # if no best_match was found, there might be an error
-            if not best_match:
-                num = word.count('\n', 0, pos)
-                char_at = pos - word.rfind('\n', 0, pos)
+            # if no match was found, there might be an error
+            if token < 0:
+                return [("", self.error(word, pos))]
 
-                if word[pos] not in self.dfa.S:
-                    return [("", f"No viable alternative at character {char_at - 1}, line {num}")]
-                if pos == len(word) - 1:
-                    return [("", f"No viable alternative at character EOF, line {num}")]
-                else:
-                    return [("", f"No viable alternative at character {char_at}, line {num}")]
+            # a skipped token longer than all the keywords can't be one, so it is dropped without cutting it out
+            if token in skip and end - pos > longest:
+                pos = end
+                continue
 
             # add the token and the match to the list of matches
-            matches.append((token, best_match))
-            pos += len(best_match)
+            lexeme = word[pos:end]
+            if keywords:
+                # resolve_keyword, inlined
+                keyword = keywords.get(lexeme)
+                if keyword is not None and keyword < token:
+                    token = keyword
+            if token not in skip:
+                matches.append((tokens[token], lexeme))
+            pos = end
+
+        return matches
+
+    def lex_counted(self, word: str) -> list[tuple[str, str]] | None:
+        # lex, counting the tokens and how far the dfa read for each of them in the stats. it is a separate copy of
+        # the loop, so lex doesn't pay for the counters when stats are off
+        stats = self.stats
+        start_time = perf_counter()
+        matches = []
+        pos = 0
+        length = len(word)
+        scan, q0, tokens = self.compiled.scan, self.compiled.q0, self.tokens
+        counts = stats.token_counts
+
+        stats.words += 1
+        stats.chars += length
+        while pos < length:
+            _, stop, token, end = scan(word, pos, length, q0, -1, pos)
+
+            if token < 0:
+                stats.errors += 1
+                matches = [("", self.error(word, pos))]
+                break
+
+            lexeme = word[pos:end]
+            token = self.keyword(token, lexeme)
+            name = tokens[token]
+            if token not in self.skip:
+                matches.append((name, lexeme))
+            counts[name] = counts.get(name, 0) + 1
+
+            stats.tokens += 1
+            stats.lookahead += stop - pos
+            stats.backtrack += stop - end
+            stats.max_lookahead = max(stats.max_lookahead, stop - pos)
+            stats.max_backtrack = max(stats.max_backtrack, stop - end)
+            pos = end
+
+        stats.lex_seconds += perf_counter() - start_time
+        return matches
+
+    def lex_compact(self, word: str) -> Tokens:
+        # lex the word like lex, but keep the tokens as arrays of token ids and positions (with the line and column
+        # where every token starts, counted along the way) instead of a list of tuples of strings
+        result = Tokens(self.tokens, word)
+        ids, starts, ends, lines, columns = result.ids, result.starts, result.ends, result.lines, result.columns
+        pos = line = column = 0
+        length = len(word)
+        scan, q0, keywords, skip = self.compiled.scan, self.compiled.q0, self.keywords, self.skip
+
+        while pos < length:
+            _, _, token, end = scan(word, pos, length, q0, -1, pos)
+
+            if token < 0:
+                result.error = error_message(self.compiled.known(word[pos]), line, column, pos == length - 1)
+                break
+
+            if keywords:
+                token = self.keyword(token, word[pos:end])
+            if token not in skip:
+                ids.append(token)
+                starts.append(pos)
+                ends.append(end)
+                lines.append(line)
+                columns.append(column)
+
+            # move the line and column past the lexeme, without cutting it out of the word
+            newlines = word.count('\n', pos, end)
+            if newlines:
+                line += newlines
+                column = end - word.rfind('\n', pos, end) - 1
+            else:
+                column += end - pos
+
+            pos = end
+
+        return result
+
+    def lex_parallel(self, word: str, workers: int | None = None, chunk_size: int = 1 << 20) \
+            -> list[tuple[str, str]] | None:
+        # lex a large word in a process pool. the word is split into chunks at newlines, guessing that a token starts
+        # right after them, and each chunk is lexed on its own. the chunks are then stitched together, lexing again
+        # wherever a guess was wrong, so the result is always the same as the one of lex
+        bounds = chunk_bounds(word, chunk_size)
+        if len(bounds) <= 2:
+            return self.lex(word)
+
+        chunks = [word[bounds[k]:bounds[k + 1]] for k in range(len(bounds) - 1)]
+        lasts = [k == len(chunks) - 1 for k in range(len(chunks))]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lex_chunk, repeat(self.compiled), chunks, lasts, repeat(self.keywords)))
+
+        matches = []
+        pos = 0
+        for k, result in enumerate(results):
+            for found in stitch(self.compiled, self.keywords, word, bounds[k], bounds[k + 1], pos, result):
+                # the last token ends where the next chunk takes over, or is the error
+                token, _, pos = found[-1]
+                if token < 0:
+                    return [("", self.error(word, pos))]
+                matches.extend((self.tokens[token], word[start:end]) for token, start, end in found
+                               if token not in self.skip)
+
+        return matches
+
+    def iter_tokens(self, stream: TextIO | BinaryIO, chunk_size: int = 1 << 16, skipped: bool = False) \
+            -> Iterator[tuple[str, str, int, int]]:
+        # lex a text or binary (utf-8) file object, reading it in chunks of chunk_size, and yield
+        # (token, lexeme, line, column) tuples as they are found. only the current token and the rest of the current
+        # chunk are kept in memory. on error, ("", message, line, column) is yielded and the iteration stops. with
+        # skipped, the tokens of the skip rules are yielded too
+        chunks = self.chunks(stream, chunk_size)
+        scan, q0, tokens = self.compiled.scan, self.compiled.q0, self.tokens
+        skip = frozenset() if skipped else self.skip
+        buffer = next(chunks, "")
+        pos = 0
+        eof = not buffer
+        line = column = 0
+
+        while True:
+            if pos == len(buffer):
+                if eof:
+                    return
+                buffer = next(chunks, "")
+                pos = 0
+                if not buffer:
+                    return
+
+            state, stop, token, end = scan(buffer, pos, len(buffer), q0, -1, pos)
+
+            # the dfa ran off the end of the buffer while still alive, so keep the state and feed it the next chunk
+            while state != DEAD and stop == len(buffer) and not eof:
+                chunk = next(chunks, "")
+                if not chunk:
+                    eof = True
+                    break
+
+                buffer = buffer[pos:] + chunk
+                stop, end, pos = stop - pos, end - pos, 0
+                state, stop, token, end = scan(buffer, stop, len(buffer), state, token, end)
+
+            if token < 0:
+                # to tell if the error is at the last character, we may need to look at the next chunk
+                last = pos == len(buffer) - 1
+                if last and not eof:
+                    last = not next(chunks, "")
+
+                yield "", error_message(self.compiled.known(buffer[pos]), line, column, last), line, column
+                return
+
+            lexeme = buffer[pos:end]
+            token = self.keyword(token, lexeme)
+            if token not in skip:
+                yield tokens[token], lexeme, line, column
+
+            # move the line and column past the lexeme
+            newlines = lexeme.count('\n')
+            if newlines:
+                line += newlines
+                column = len(lexeme) - lexeme.rfind('\n') - 1
+            else:
+                column += len(lexeme)
+
+            pos = end
+
+    @staticmethod
+    def chunks(stream: TextIO | BinaryIO, chunk_size: int) -> Iterator[str]:
+        # read the stream in chunks, decoding bytes as utf-8. only the end of the stream gives an empty chunk
+        decoder = None
+
+        while True:
+            data = text = stream.read(chunk_size)
+            if isinstance(data, bytes):
+                if decoder is None:
+                    decoder = codecs.getincrementaldecoder('utf-8')()
+                text = decoder.decode(data, final=not data)
+
+            if text:
+                yield text
+            if not data:
+                return
+
+    def lex_bytes(self, data: bytes | memoryview) -> list[tuple[int, int, int]]:
+        # lex utf-8 bytes directly, without decoding them, and return (token id, start, end) tuples with the byte
+        # offsets of each lexeme. if no match can be found at some offset, the list ends with (-1, offset, offset)
+        if self.compiled_bytes is None:
+            if not isinstance(self.compiled, CompiledDFA):
+                raise ValueError('lexing bytes needs the compiled tables, which are not built in lazy mode')
+            self.compiled_bytes = utf8_dfa(self.compiled)
+
+        matches = []
+        pos = 0
+        length = len(data)
+        scan, q0, skip = self.compiled_bytes.scan_bytes, self.compiled_bytes.q0, self.skip
+        longest = max((len(keyword.encode('utf-8')) for keyword in self.keywords), default=0)
+
+        while pos < length:
+            _, _, token, end = scan(data, pos, length, q0, -1, pos)
+
+            if token < 0:
+                matches.append((-1, pos, pos))
+                break
+
+            if end - pos <= longest:
+                token = self.keyword(token, bytes(data[pos:end]).decode('utf-8', 'replace'))
+            if token not in skip:
+                matches.append((token, pos, end))
+            pos = end
+
+        return matches
+
+    def lex_file(self, path: str | os.PathLike, lexemes: bool = False) \
+            -> list[tuple[int, int, int]] | list[tuple[int, int, int, memoryview]]:
+        # memory map the file and lex its bytes with lex_bytes. if lexemes is set, a memoryview of each lexeme is added
+        # to its tuple, and the file stays mapped for as long as these views are alive
+        with open(path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return []
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        view = memoryview(data)
+        matches = self.lex_bytes(view)
+
+        if lexemes:
+            return [(token, start, end, view[start:end]) for token, start, end in matches]
+
+        view.release()
+        data.close()
+        return matches
+
+    def keyword(self, token: int, lexeme: str) -> int:
+        # the token of a lexeme, which may be a keyword coming earlier in the spec than the token the dfa found
+        return resolve_keyword(self.keywords, token, lexeme)
+
+    def error(self, word: str, pos: int) -> str:
+        # build the error message for a word that has no match starting at pos
+        return error(self.compiled, word, pos)
+
+    def lex_many(self, words: Iterable[str], executor: Executor | None = None, batch_size: int = 10000) -> TokenBatch:
+        # lex many (usually short) words at once. the tokens of all the words are returned in typed arrays, each with
+        # the index of the word it comes from, and a word that fails to lex only adds an error to the batch.
+        # if an executor is given, the words are lexed in batches of batch_size on it
+        if executor is None:
+            ids, starts, ends, inputs, errors = lex_batch(self.compiled, self.keywords, words, 0, self.skip)
+            return TokenBatch(self.tokens, ids, starts, ends, inputs, errors)
+
+        futures = []
+        batch = []
+        first = 0
+        for word in words:
+            batch.append(word)
+            if len(batch) == batch_size:
+                futures.append(executor.submit(lex_batch, self.compiled, self.keywords, batch, first, self.skip))
+                first += len(batch)
+                batch = []
+        if batch:
+            futures.append(executor.submit(lex_batch, self.compiled, self.keywords, batch, first, self.skip))
+
+        result = TokenBatch(self.tokens, array('i'), array('q'), array('q'), array('q'), [])
+        for future in futures:
+            ids, starts, ends, inputs, errors = future.result()
+            result.ids += ids
+            result.starts += starts
+            result.ends += ends
+            result.inputs += inputs
+            result.errors += errors
+
+        return result
+
+
+def resolve_keyword(keywords: dict[str, int], token: int, lexeme: str) -> int:
+    # the token of a lexeme found as token: a keyword wins over the token when it comes earlier in the spec
+    keyword = keywords.get(lexeme)
+    return keyword if keyword is not None and keyword < token else token
+
+
+def error(compiled: CompiledDFA, word: str, pos: int) -> str:
+    # build the error message for a word that has no match starting at pos
+    line = word.count('\n', 0, pos)
+    column = pos - word.rfind('\n', 0, pos) - 1
+
+    return error_message(compiled.known(word[pos]), line, column, pos == len(word) - 1)
+
+
+def error_message(known: bool, line: int, column: int, last: bool) -> str:
+    # known tells if the character where the failed match starts is in the alphabet, last if it is the last one
+    if not known:
+        return f"No viable alternative at character {column}, line {line}"
+    if last:
+        return f"No viable alternative at character EOF, line {line}"
+    else:
+        return f"No viable alternative at character {column + 1}, line {line}"
+
+
+def cache_key(spec: list[tuple[str, str]]) -> str:
+    # hash of the spec, the format of the saved tables and the code that compiles them
+    key = hashlib.sha256(json.dumps([FORMAT_VERSION, spec]).encode('utf-8'))
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for source in SOURCES:
+        with open(os.path.join(directory, source), 'rb') as file:
+            key.update(file.read())
+
+    return key.hexdigest()
+
+
+@contextmanager
+def atomic_write(path: str | os.PathLike, mode: str = 'w') -> Iterator[IO]:
+    # a file to write the content of path in. it is written under a temporary name and then moved in place, so
+    # processes reading path at the same time never see it half written. if anything fails, the temporary file is
+    # removed
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    file = tempfile.NamedTemporaryFile(mode, dir=directory, delete=False)
+    try:
+        with file:
+            yield file
+        os.replace(file.name, path)
+    except BaseException:
+        with suppress(OSError):
+            os.unlink(file.name)
+        raise
+
+
+def chunk_bounds(word: str, chunk_size: int) -> list[int]:
+    # the offsets where the chunks of a word start, followed by its length. every chunk but the last one has at least
+    # chunk_size characters and ends right after a newline
+    bounds = [0]
+    while True:
+        newline = word.find('\n', bounds[-1] + chunk_size)
+        if newline == -1 or newline + 1 >= len(word):
+            break
+        bounds.append(newline + 1)
+    bounds.append(len(word))
+
+    return bounds
+
+
+def lex_chunk(compiled: CompiledDFA, chunk: str, last: bool, keywords: dict[str, int] | None = None) \
+        -> tuple[array, array, array, int, bool]:
+    # lex a chunk for lex_parallel, as if a token started at its beginning. returns the token ids (those of the
+    # keywords where they apply), starts and ends of the matches that are certain, the position where they stop and
+    # whether lexing failed there. a match that reaches the end of the chunk with the dfa still alive might continue in
+    # the next chunk, so it is left out unless this is the last chunk
+    tokens, starts, ends = array('i'), array('q'), array('q')
+    pos = 0
+    length = len(chunk)
+
+    while pos < length:
+        state, stop, token, end = compiled.scan(chunk, pos, length, compiled.q0, -1, pos)
+
+        if state != DEAD and stop == length and not last:
+            break
+        if token < 0:
+            return tokens, starts, ends, pos, True
+
+        if keywords:
+            token = resolve_keyword(keywords, token, chunk[pos:end])
+        tokens.append(token)
+        starts.append(pos)
+        ends.append(end)
+        pos = end
+
+    return tokens, starts, ends, pos, False
+
+
+def stitch(compiled: CompiledDFA, keywords: dict[str, int], word: str, base: int, end: int, pos: int,
+           chunk: tuple[array, array, array, int, bool]) -> Iterator[list[tuple[int, int, int]]]:
+    # stitch the result of lex_chunk for the chunk of the word from base to end onto the tokens lexed up to pos. yields
+    # the (token id, start, end) of the tokens from pos to the end of the chunk (the last one may end in a later chunk),
+    # in lists of the tokens found at once, ending with [(-1, pos, pos)] if no token matches at pos
+    tokens, starts, ends, stop, failed = chunk
+
+    while pos < end:
+        # if a match of the chunk starts here, the chunk is in sync and all its matches from here on are right
+        index = bisect_left(starts, pos - base)
+        if index < len(starts) and starts[index] == pos - base:
+            yield [(token, base + start, base + token_end) for token, start, token_end in
+                   zip(tokens[index:], starts[index:], ends[index:])]
+            pos = base + stop
+        # otherwise, lex one token here until we get back in sync with the chunk
+        elif pos - base != stop or not failed:
+            token, match_end = compiled.match(word, pos)
+            if token < 0:
+                yield [(-1, pos, pos)]
+                return
+            yield [(resolve_keyword(keywords, token, word[pos:match_end]), pos, match_end)]
+            pos = match_end
+            continue
+
+        if failed:
+            yield [(-1, pos, pos)]
+            return
+
+
+def lex_batch(compiled: CompiledDFA, keywords: dict[str, int], words: Iterable[str], first: int,
+              skip: frozenset[int] = frozenset()) -> tuple[array, array, array, array, list[tuple[int, str]]]:
+    # lex the words for lex_many, numbering them from first. returns the token ids, starts, ends and word indices of
+    # all the tokens but the skipped ones, and the errors of the words that could not be lexed (their tokens are left
+    # out)
+    ids, starts, ends, inputs = array('i'), array('q'), array('q'), array('q')
+    errors = []
+
+    # the scanning loop is inlined for the compiled tables, as for short words the cost of the calls would be larger
+    # than the scan itself. a lazy dfa has no tables, so its own scan is called instead
+    inline = isinstance(compiled, CompiledDFA)
+    if inline:
+        table, classes, accepts, n = compiled.table, compiled.classes, compiled.accepts, compiled.n_classes
+    scan, symbol_class, q0 = compiled.scan, compiled.symbol_class, compiled.q0
+
+    for index, word in enumerate(words, first):
+        pos = 0
+        length = len(word)
+        mark = len(ids)
+
+        while pos < length:
+            if not inline:
+                _, _, token, end = scan(word, pos, length, q0, -1, pos)
+            else:
+                state = q0
+                token = -1
+                i = end = pos
+                while i < length:
+                    cls = classes.get(word[i])
+                    if cls is None:
+                        cls = symbol_class(word[i])
+
+                    state = table[state * n + cls]
+                    if state == DEAD:
+                        break
+
+                    i += 1
+                    if accepts[state] >= 0:
+                        token = accepts[state]
+                        end = i
+
+            if token < 0:
+                errors.append((index, error(compiled, word, pos)))
+                del ids[mark:], starts[mark:], ends[mark:], inputs[mark:]
+                break
+
+            if keywords:
+                # resolve_keyword, inlined
+                keyword = keywords.get(word[pos:end])
+                if keyword is not None and keyword < token:
+                    token = keyword
+
+            if token not in skip:
+                ids.append(token)
+                starts.append(pos)
+                ends.append(end)
+                inputs.append(index)
+            pos = end
 
-        return matches
\ No newline at end of file
+    return ids, starts, ends, inputs, errors
@@ -0,0 +1,55 @@
+from src.Lexer import Lexer
+from collections import OrderedDict
+import json
+import os
+
+
+class LexerPool:
+    # compiled lexers kept by spec, so a spec is only compiled once for all the words lexed with it. when there are
+    # more than capacity lexers, the least recently used one is dropped. with a cache directory, the tables of every
+    # lexer are saved there, so a dropped lexer (or one compiled by another process sharing the directory) is loaded
+    # again instead of being compiled
+
+    def __init__(self, capacity: int = 64, cache_dir: str | os.PathLike | None = None) -> None:
+        if capacity < 1:
+            raise ValueError(f'the capacity of a lexer pool must be at least 1, not {capacity}')
+
+        self.capacity = capacity
+        self.cache_dir = cache_dir
+        self.lexers: OrderedDict[str, Lexer] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.lexers)
+
+    def __contains__(self, spec: list[tuple[str, str]]) -> bool:
+        return spec_key(spec) in self.lexers
+
+    def get(self, spec: list[tuple[str, str]]) -> Lexer:
+        # the lexer of a spec, compiled (or loaded from the cache directory) if it is not in the pool
+        key = spec_key(spec)
+        lexer = self.lexers.get(key)
+        if lexer is not None:
+            self.hits += 1
+            self.lexers.move_to_end(key)
+            return lexer
+
+        self.misses += 1
+        return self.add(spec, Lexer(spec, cache_dir=self.cache_dir))
+
+    def add(self, spec: list[tuple[str, str]], lexer: Lexer) -> Lexer:
+        # put the lexer of a spec, compiled or loaded elsewhere, in the pool
+        self.lexers[spec_key(spec)] = lexer
+        if len(self.lexers) > self.capacity:
+            self.lexers.popitem(last=False)
+            self.evictions += 1
+
+        return lexer
+
+
+def spec_key(spec: list[tuple[str, str]]) -> str:
+    # the key of a spec in the pool. specs given as lists of lists (as they come out of json) get the same key as
+    # lists of tuples
+    return json.dumps([[token, regex] for token, regex in spec])
@@ -1,6 +1,10 @@
 from .DFA import DFA
+from .Alphabet import CharRange, atoms, bounds
+from .BitNFA import BitNFA
 
-from dataclasses import dataclass
+from bisect import bisect_right
+
+from dataclasses import dataclass, field
 from collections.abc import Callable
 from typing import TypeVar
 
@@ -10,11 +14,27 @@ OTHER_STATE = TypeVar('OTHER_STATE')
 
 @dataclass
 class NFA[STATE]:
-    S: set[str]
+    S: set[str | CharRange]
     K: set[STATE]
     q0: STATE
-    d: dict[tuple[STATE, str], set[STATE]]
+    d: dict[tuple[STATE, str | CharRange], set[STATE]]
     F: set[STATE]
+    # bit parallel simulator used by accept and match_longest, built on the first call (the nfa should not be changed
+    # afterwards)
+    simulator: BitNFA | None = field(default=None, init=False, repr=False, compare=False)
+
+    def accept(self, word: str) -> bool:
+        # simulate the nfa on the given word, without building a dfa. cheaper than the subset construction for
+        # patterns that are only used a few times, or whose dfa would be too large
+        if self.simulator is None:
+            self.simulator = BitNFA(self)
+        return self.simulator.accept(word)
+
+    def match_longest(self, word: str, pos: int = 0) -> int:
+        # the end of the longest prefix of word[pos:] accepted by the nfa, or -1 if there is none
+        if self.simulator is None:
+            self.simulator = BitNFA(self)
+        return self.simulator.match_longest(word, pos)
 
     def epsilon_closure(self, state: STATE) -> set[STATE]:
         # compute the epsilon closure of a state (you will need this for subset construction)
@@ -34,63 +54,114 @@ class NFA[STATE]:
 
         return closure
 
-    def subset_construction(self) -> DFA[frozenset[STATE]]:
-        # convert this nfa to a dfa using the subset construction algorithm
-        DFA_states = set()
-        DFA_transitions = {}
-        alphabet = self.S - {EPSILON}
-        initial_closure = frozenset(self.epsilon_closure(self.q0))
+    def subset_construction(self, closures: dict[STATE, frozenset[STATE]] | None = None) -> DFA[frozenset[STATE]]:
+        # convert this nfa to a dfa using the subset construction algorithm. closures memoizes the epsilon closure of
+        # each state, a dict can be given to reuse them or to see which ones were computed
+        if closures is None:
+            closures = {}
+        pieces, moves = self.atom_moves(closures)
+
+        # the subsets are interned as ints, in the order they are found
+        subsets = [self.closure(self.q0, closures)]
+        ids = {subsets[0]: 0}
+        transitions = {}
+
+        current = 0
+        while current < len(subsets):
+            # only the atoms that leave some state of the current subset are tried
+            next_states = {}
+            for state in subsets[current]:
+                for atom, reached in moves.get(state, {}).items():
+                    if atom in next_states:
+                        next_states[atom] |= reached
+                    else:
+                        next_states[atom] = set(reached)
+
+            for atom, states in next_states.items():
+                subset = frozenset(states)
+                if subset not in ids:
+                    ids[subset] = len(subsets)
+                    subsets.append(subset)
+                transitions[current, atom] = ids[subset]
+
+            current += 1
+
+        # every missing transition goes to the sink state, the empty subset
         sink_state = frozenset()
-        DFA_states.add(initial_closure)
-        stack = [initial_closure]
-
-        # check if the DFA has a sink state
-        sink = False
-
-        while stack:
-            current_state = stack.pop()
-
-            # iterate over the alphabet
-            for symbol in alphabet:
-                next_states = set()
-
-                # iterate over the closure of the current state
-                for state in current_state:
-                    if (state, symbol) in self.d:
-                        next_states.update(self.d.get((state, symbol), []))
-
-                # compute the epsilon closure of the next states
-                next_closure = frozenset(
-                    state for next_state in next_states for state in self.epsilon_closure(next_state)
-                )
-
-                # if there is no next state, go to the sink state
-                if not next_closure:
-                    next_closure = sink_state
-                    sink = True # the DFA has a sink state
-
-                if next_closure not in DFA_states:
-                    DFA_states.add(next_closure)
-                    stack.append(next_closure)
-
-                DFA_transitions[current_state, symbol] = next_closure
+        DFA_states = set(subsets)
+        DFA_transitions = {}
+        for (current, atom), target in transitions.items():
+            DFA_transitions[subsets[current], pieces[atom]] = subsets[target]
 
-        # add the sink state to the DFA
-        if sink:
+        if len(transitions) < len(subsets) * len(pieces):
             DFA_states.add(sink_state)
-            for symbol in alphabet: # add the from the sink state to itself
-                DFA_transitions[sink_state, symbol] = sink_state
+            for state in DFA_states:
+                for piece in pieces:
+                    DFA_transitions.setdefault((state, piece), sink_state)
 
-        DFA_final_states = {state for state in DFA_states if any(s in self.F for s in state)}
+        DFA_final_states = {state for state in DFA_states if not self.F.isdisjoint(state)}
 
         return DFA(
-            S=alphabet,
+            S=set(pieces),
             K=DFA_states,
-            q0=initial_closure,
+            q0=subsets[0],
             d=DFA_transitions,
             F=DFA_final_states
         )
 
+    def atom_moves(self, closures: dict[STATE, frozenset[STATE]]) \
+            -> tuple[list[str | CharRange], dict[STATE, dict[int, frozenset[STATE]]]]:
+        # the labels of the nfa can be characters or ranges of characters, which may overlap. a dfa runs over the
+        # smallest disjoint pieces (atoms) of these labels, and each atom is reached through the labels that contain it.
+        # returns the atoms, and for every state the indices of the atoms it has transitions on, together with the
+        # epsilon closure of the states they lead to. closures memoizes the closure of each state
+        alphabet = self.S - {EPSILON}
+        pieces = atoms(alphabet)
+        starts = [bounds(piece)[0] for piece in pieces]
+        label_atoms = {symbol: range(*self.atom_indices(symbol, starts)) for symbol in alphabet}
+
+        moves = {}
+        for (state, symbol), targets in self.d.items():
+            if symbol == EPSILON or not targets:
+                continue
+
+            reached = frozenset().union(*(self.closure(target, closures) for target in targets))
+            state_moves = moves.setdefault(state, {})
+            for atom in label_atoms[symbol]:
+                if atom in state_moves:
+                    state_moves[atom] = state_moves[atom] | reached
+                else:
+                    state_moves[atom] = reached
+
+        return pieces, moves
+
+    def closure(self, state: STATE, closures: dict[STATE, frozenset[STATE]]) -> frozenset[STATE]:
+        # the epsilon closure of a state, memoized in closures
+        if state not in closures:
+            closures[state] = frozenset(self.epsilon_closure(state))
+        return closures[state]
+
+    @staticmethod
+    def atom_indices(symbol: str | CharRange, starts: list[int]) -> tuple[int, int]:
+        # the indices of the first atom of a label and of the one after its last, given the starts of the atoms
+        lo, hi = bounds(symbol)
+        return bisect_right(starts, lo) - 1, bisect_right(starts, hi)
+
+    def new_state(self) -> int:
+        # add a new state to a nfa whose states are the ints from 0 to len(K) - 1, and return it
+        state = len(self.K)
+        self.K.add(state)
+        return state
+
+    def add_transition(self, state: STATE, symbol: str | CharRange, target: STATE) -> None:
+        # add a transition to the nfa, keeping the transitions already there
+        self.S.add(symbol)
+        targets = self.d.get((state, symbol))
+        if targets is None:
+            self.d[state, symbol] = {target}
+        else:
+            targets.add(target)
+
     def remap_states[OTHER_STATE](self, f: 'Callable[[STATE], OTHER_STATE]') -> 'NFA[OTHER_STATE]':
         # optional, but may be useful for the second stage of the project. Works similarly to 'remap_states'
         # from the DFA class. See the comments there for more details.
@@ -1,14 +1,242 @@
-from .DFA import DFA
-from .NFA import NFA
-from .Regex import Regex, parse_regex
-from .Lexer import Lexer
-
-
-class Parser():
-    def __init__(self, input: str) -> None:
-        pass
-    
-    def parse(self, input: str) -> None:
-        # this method should parse the input string and print the result of the parsing process
-        pass
-    
+from .Lexer import Lexer, atomic_write
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from typing import BinaryIO, TextIO
+import hashlib
+import io
+import json
+import os
+
+END = '$'  # the terminal standing for the end of the input in the parse table
+TABLE_VERSION = 1
+
+# parse tables already built in this process, by the key of their grammar
+TABLES: dict[str, dict[tuple[str, str], tuple[str, ...]]] = {}
+
+
+class GrammarError(ValueError):
+    pass
+
+
+class ParseError(ValueError):
+    def __init__(self, message: str, line: int, column: int):
+        super().__init__(f"{message} at line {line}, column {column}")
+        self.line = line
+        self.column = column
+
+
+@dataclass
+class Node:
+    # a nonterminal of the parse tree, with its children: other nodes, and (token, lexeme) tuples for the terminals
+    symbol: str
+    children: list['Node | tuple[str, str]'] = field(default_factory=list)
+
+
+class Parser:
+    # a table driven LL(1) parser. the grammar is a list of productions (nonterminal, [symbols]), the first
+    # nonterminal being the start symbol, and every symbol that is not a nonterminal being a token of the lexer.
+    # the tokens are pulled from the lexer one at a time while parsing, so only the parse stack is kept in memory.
+    # tokens in skip (like spaces or comments), and those of the skip rules of the lexer, are dropped before they get
+    # to the parser
+
+    def __init__(self, grammar: list[tuple[str, list[str]]], lexer: Lexer, skip: set[str] | None = None,
+                 cache_dir: str | os.PathLike | None = None) -> None:
+        if not grammar:
+            raise GrammarError("empty grammar")
+
+        self.grammar = [(lhs, tuple(rhs)) for lhs, rhs in grammar]
+        self.lexer = lexer
+        self.skip = set(skip or ()) | {lexer.tokens[token] for token in lexer.skip}
+        self.start = self.grammar[0][0]
+        self.nonterminals = {lhs for lhs, _ in self.grammar}
+
+        unknown = {symbol for _, rhs in self.grammar for symbol in rhs} - self.nonterminals - set(lexer.tokens)
+        if unknown:
+            raise GrammarError(f"symbols that are neither nonterminals nor tokens: {', '.join(sorted(unknown))}")
+
+        # the table is built once per grammar: it is looked up in the tables of this process, then in the cache
+        # directory, and only built if it is in neither
+        key = table_key(self.grammar)
+        self.table = TABLES.get(key)
+        if self.table is None:
+            path = None if cache_dir is None else os.path.join(cache_dir, key + '.ll1')
+            if path is None or not self.load(path):
+                self.table = self.build()
+                if path is not None:
+                    # like for the lexer tables, a cache that can't be written doesn't stop the parser from working
+                    try:
+                        self.save(path)
+                    except OSError:
+                        pass
+            TABLES[key] = self.table
+
+    def first_sets(self) -> tuple[set[str], dict[str, set[str]]]:
+        # the nullable nonterminals and the first set of every nonterminal, as a fixed point
+        nullable = set()
+        first = {nonterminal: set() for nonterminal in self.nonterminals}
+
+        changed = True
+        while changed:
+            changed = False
+            for lhs, rhs in self.grammar:
+                size = len(first[lhs])
+                first[lhs] |= self.first_of(rhs, nullable, first)
+                if lhs not in nullable and all(symbol in nullable for symbol in rhs):
+                    nullable.add(lhs)
+                    changed = True
+                changed = changed or len(first[lhs]) != size
+
+        return nullable, first
+
+    def first_of(self, symbols: tuple[str, ...], nullable: set[str], first: dict[str, set[str]]) -> set[str]:
+        # the first set of a sequence of symbols
+        result = set()
+        for symbol in symbols:
+            if symbol not in self.nonterminals:
+                result.add(symbol)
+                return result
+            result |= first[symbol]
+            if symbol not in nullable:
+                return result
+
+        return result
+
+    def follow_sets(self, nullable: set[str], first: dict[str, set[str]]) -> dict[str, set[str]]:
+        follow = {nonterminal: set() for nonterminal in self.nonterminals}
+        follow[self.start].add(END)
+
+        changed = True
+        while changed:
+            changed = False
+            for lhs, rhs in self.grammar:
+                for i, symbol in enumerate(rhs):
+                    if symbol not in self.nonterminals:
+                        continue
+
+                    size = len(follow[symbol])
+                    rest = rhs[i + 1:]
+                    follow[symbol] |= self.first_of(rest, nullable, first)
+                    if all(other in nullable for other in rest):
+                        follow[symbol] |= follow[lhs]
+                    changed = changed or len(follow[symbol]) != size
+
+        return follow
+
+    def build(self) -> dict[tuple[str, str], tuple[str, ...]]:
+        # the LL(1) table: for a nonterminal and the next token, the right side of the production to expand it with.
+        # raises GrammarError if the grammar is not LL(1)
+        nullable, first = self.first_sets()
+        follow = self.follow_sets(nullable, first)
+
+        table = {}
+        for lhs, rhs in self.grammar:
+            lookaheads = self.first_of(rhs, nullable, first)
+            if all(symbol in nullable for symbol in rhs):
+                lookaheads |= follow[lhs]
+
+            for token in lookaheads:
+                if table.get((lhs, token), rhs) != rhs:
+                    raise GrammarError(f"the grammar is not LL(1): {lhs} has two productions for {token}: "
+                                       f"{' '.join(table[lhs, token]) or 'ε'} and {' '.join(rhs) or 'ε'}")
+                table[lhs, token] = rhs
+
+        return table
+
+    def load(self, path: str | os.PathLike) -> bool:
+        # load a table saved at path. returns false if there is no usable file at path
+        try:
+            with open(path) as file:
+                table = {(lhs, token): tuple(rhs) for lhs, token, rhs in json.load(file)}
+        except (OSError, ValueError, TypeError):
+            # a malformed file is only a cache miss
+            return False
+
+        self.table = table
+        return True
+
+    def save(self, path: str | os.PathLike) -> None:
+        # save the table to path, with atomic_write like Lexer.save
+        with atomic_write(path) as file:
+            json.dump([[lhs, token, list(rhs)] for (lhs, token), rhs in self.table.items()], file)
+
+    def tokens(self, input: str | TextIO | BinaryIO) -> Iterator[tuple[str, str, int, int]]:
+        # the tokens of the input that are not skipped, followed by the end of the input. the skipped tokens are still
+        # read from the lexer, to find where the input ends
+        stream = io.StringIO(input) if isinstance(input, str) else input
+        line = column = 0
+        for token, lexeme, line, column in self.lexer.iter_tokens(stream, skipped=True):
+            if not token:
+                raise ParseError("no token matches the input", line, column)
+            if token not in self.skip:
+                yield token, lexeme, line, column
+
+            # the end of the input comes after the last token
+            newlines = lexeme.count('\n')
+            line, column = (line + newlines, len(lexeme) - lexeme.rfind('\n') - 1) if newlines \
+                else (line, column + len(lexeme))
+
+        yield END, '', line, column
+
+    def parse_events(self, input: str | TextIO | BinaryIO) -> Iterator[tuple]:
+        # parse the input, yielding ('enter', nonterminal) when a nonterminal is expanded, ('token', token, lexeme,
+        # line, column) for every token and ('exit', nonterminal) when all of its symbols were parsed.
+        # raises ParseError on the first token that doesn't fit the grammar
+        table, nonterminals = self.table, self.nonterminals
+        tokens = self.tokens(input)
+        token, lexeme, line, column = next(tokens)
+
+        # the stack holds the symbols left to parse, and the nonterminals to exit as ('exit', nonterminal) tuples
+        stack = [self.start]
+        while stack:
+            symbol = stack.pop()
+            if isinstance(symbol, tuple):
+                yield symbol
+            elif symbol in nonterminals:
+                rhs = table.get((symbol, token))
+                if rhs is None:
+                    raise ParseError(f"unexpected {describe(token, lexeme)} in {symbol}, expected "
+                                     f"{' or '.join(self.expected(symbol))}", line, column)
+
+                yield 'enter', symbol
+                stack.append(('exit', symbol))
+                stack.extend(reversed(rhs))
+            elif symbol == token:
+                yield 'token', token, lexeme, line, column
+                token, lexeme, line, column = next(tokens)
+            else:
+                raise ParseError(f"unexpected {describe(token, lexeme)}, expected {symbol}", line, column)
+
+        if token != END:
+            raise ParseError(f"unexpected {describe(token, lexeme)}, expected the end of the input", line, column)
+
+    def expected(self, nonterminal: str) -> list[str]:
+        # the tokens that can start a nonterminal (or follow it, if it can be empty)
+        return sorted(describe(token, '') if token == END else token for lhs, token in self.table if lhs == nonterminal)
+
+    def parse(self, input: str | TextIO | BinaryIO) -> Node:
+        # parse the input and build its parse tree
+        stack = [Node('')]
+        for event in self.parse_events(input):
+            if event[0] == 'enter':
+                node = Node(event[1])
+                stack[-1].children.append(node)
+                stack.append(node)
+            elif event[0] == 'exit':
+                stack.pop()
+            else:
+                stack[-1].children.append((event[1], event[2]))
+
+        return stack[0].children[0]
+
+
+def describe(token: str, lexeme: str) -> str:
+    return "end of the input" if token == END else f"{token} {lexeme!r}"
+
+
+def table_key(grammar: list[tuple[str, tuple[str, ...]]]) -> str:
+    # hash of the grammar, the format of the saved tables and the code that builds them
+    key = hashlib.sha256(json.dumps([TABLE_VERSION, grammar]).encode('utf-8'))
+    with open(os.path.abspath(__file__), 'rb') as file:
+        key.update(file.read())
+
+    return key.hexdigest()
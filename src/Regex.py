@@ -1,28 +1,69 @@
+from functools import reduce
+from collections.abc import Generator
 from typing import Any, List
 from src.NFA import NFA
+from src.Alphabet import complement, label
 
-# list of special characters
-special_chars = ['|', '*',  '+', '?', '(', ')', '[', ']']
-
-# trying to simulate an abstract syntax tree
-# store the elements of the regex, the leafs of the tree
-expression = []
-# store the operations of the regex, the nodes of the tree
-operations = []
+EPSILON = ''
 
-# signals if there was a precedent expression
-precedent = False
 
-# index of the current character
-i = 0
+class RegexSyntaxError(ValueError):
+    def __init__(self, message: str, regex: str, position: int):
+        super().__init__(f"{message} at position {position} in {regex!r}")
+        self.message = message
+        self.regex = regex
+        self.position = position
 
-EPSILON = ''
+    def __reduce__(self):
+        # pickled with the arguments of __init__, so the errors raised in worker processes can be sent back
+        return type(self), (self.message, self.regex, self.position)
 
 class Regex:
     def thompson(self) -> NFA[int]:
-        raise NotImplementedError('the thompson method of the Regex class should never be called')
-
-# you should extend this class with the type constructors of regular expressions and overwrite the 'thompson' method
+        # build the nfa of the regex: all the states come from one counter and all the transitions go to one nfa, so
+        # the construction is linear in the size of the regex
+        nfa = NFA(S=set(), K=set(), q0=0, d={}, F=set())
+        nfa.q0, final = self.build(nfa)
+        nfa.F = {final}
+
+        return nfa
+
+    def build(self, nfa: NFA[int]) -> tuple[int, int]:
+        # add the states and transitions of the regex to the nfa, and return its initial and final state. the regexes
+        # nested in it are built with a stack instead of recursively, so deep nesting doesn't hit the recursion limit:
+        # steps either returns the states right away, or is a generator yielding the nested regexes it needs, which
+        # gets their states back
+        steps = self.steps(nfa)
+        if isinstance(steps, tuple):
+            return steps
+
+        stack = []
+        states = None
+        while True:
+            try:
+                nested = steps.send(states)
+            except StopIteration as stop:
+                states = stop.value
+                if not stack:
+                    return states
+                steps = stack.pop()
+                continue
+
+            # the states of a regex without nested ones go straight back to the generator that asked for them
+            states = nested.steps(nfa)
+            if not isinstance(states, tuple):
+                stack.append(steps)
+                steps = states
+                states = None
+
+    def steps(self, nfa: NFA[int]) -> tuple[int, int] | Generator['Regex', tuple[int, int], tuple[int, int]]:
+        raise NotImplementedError('the steps method of the Regex class should never be called')
+
+    def literal(self) -> str | None:
+        # the only word matched by the regex, if it is a plain word (like a keyword or an operator), None otherwise
+        return None
+
+# you should extend this class with the type constructors of regular expressions and overwrite the 'steps' method
 # with the specific nfa patterns. for example, parse_regex('ab').thompson() should return something like:
 
 # >(0) --a--> (1) -epsilon-> (2) --b--> ((3))
@@ -34,39 +75,51 @@ class Character(Regex):
         self.char = char
 
     # implement the thompson construction for a character
-    def thompson(self) -> NFA[int]:
-        q0 = 0
-        q1 = 1
-        S = {self.char}
-        d = {(q0, self.char): {q1}}
+    def steps(self, nfa: NFA[int]) -> tuple[int, int]:
+        q0 = nfa.new_state()
+        q1 = nfa.new_state()
+        nfa.add_transition(q0, self.char, q1)
+
+        return q0, q1
 
-        return NFA(S=S, K={q0, q1}, q0=q0, d=d, F={q1})
+    def literal(self) -> str | None:
+        return self.char
 
 class Concat(Regex):
     def __init__(self, left: Regex, right: Regex):
         self.left = left
         self.right = right
 
-    # implement the thompson construction for the concatenation of two regexes
-    def thompson(self) -> NFA[int]:
-        nfa_left = self.left.thompson()
-        nfa_right = self.right.thompson().remap_states(lambda x: x + len(nfa_left.K))
-        # remap the states of one of the NFAs to avoid conflicts
-
-        S = nfa_left.S.union(nfa_right.S)
-        K = nfa_left.K.union(nfa_right.K)
+    def parts(self) -> list[Regex]:
+        # the regexes of a chain of concatenations, found in a loop rather than recursively, so long words don't hit
+        # the recursion limit
+        parts = []
+        stack = [self]
+        while stack:
+            regex = stack.pop()
+            if isinstance(regex, Concat):
+                stack.append(regex.right)
+                stack.append(regex.left)
+            else:
+                parts.append(regex)
+
+        return parts
 
-        d = nfa_left.d.copy()
-        d.update(nfa_right.d)
-
-        # add epsilon transitions from the final states of the left nfa to the initial state of the right nfa
-        for state in nfa_left.F:
-            d[(state, EPSILON)] = {nfa_right.q0}
+    # implement the thompson construction for the concatenation of two regexes
+    def steps(self, nfa: NFA[int]) -> Generator[Regex, tuple[int, int], tuple[int, int]]:
+        parts = self.parts()
+        q0, final = yield parts[0]
+        for part in parts[1:]:
+            # add an epsilon transition from the final state of the left nfa to the initial state of the right nfa
+            start, end = yield part
+            nfa.add_transition(final, EPSILON, start)
+            final = end
 
-        q0 = nfa_left.q0
-        F = nfa_right.F
+        return q0, final
 
-        return NFA(S=S, K=K, q0=q0, d=d, F=F)
+    def literal(self) -> str | None:
+        chars = [part.literal() for part in self.parts()]
+        return None if None in chars else ''.join(chars)
 
 class Union(Regex):
     def __init__(self, left: Regex, right: Regex):
@@ -74,56 +127,49 @@ class Union(Regex):
         self.right = right
 
     # implement the thompson construction for the union of two regexes
-    def thompson(self) -> NFA[int]:
-        nfa_left = self.left.thompson()
-        nfa_right = self.right.thompson().remap_states(lambda x : x + len(nfa_left.K))  # so that no states repeat in the resulting nfa
-        # no need to remap the states anymore, case the new initial and final states will be unique
-
-        S = nfa_left.S.union(nfa_right.S)
-        K = nfa_left.K.union(nfa_right.K)
-
-        new_q0 = max(K) + 1
-        new_F = max(K) + 2
-
-        K |= {new_q0, new_F} # add the new initial and final states
-
-        d = nfa_left.d.copy()
-        d.update(nfa_right.d)
-
-        # add epsilon transitions from the new initial state to the initial states of the left and right nfas
-        d[(new_q0, EPSILON)] = {nfa_left.q0, nfa_right.q0}
-
-        # add epsilon transitions from the final states of the left and right nfas to the new final state
-        for state in nfa_left.F:
-            d[(state, EPSILON)] = {new_F}
-        for state in nfa_right.F:
-            d[(state, EPSILON)] = {new_F}
-
-        return NFA(S=S, K=K, q0=new_q0, d=d, F={new_F})
+    def steps(self, nfa: NFA[int]) -> Generator[Regex, tuple[int, int], tuple[int, int]]:
+        # a chain of unions shares one new initial and final state, and is built in a loop like the concatenations
+        parts = []
+        stack = [self]
+        while stack:
+            regex = stack.pop()
+            if isinstance(regex, Union):
+                stack.append(regex.right)
+                stack.append(regex.left)
+            else:
+                parts.append(regex)
+
+        new_q0 = nfa.new_state()
+        new_F = nfa.new_state()
+
+        # add epsilon transitions from the new initial state to the initial state of every alternative, and from their
+        # final states to the new final state
+        for part in parts:
+            start, end = yield part
+            nfa.add_transition(new_q0, EPSILON, start)
+            nfa.add_transition(end, EPSILON, new_F)
+
+        return new_q0, new_F
 
 class Star(Regex):
     def __init__(self, inner: Regex):
         self.inner = inner
 
     # implement the thompson construction for the kleene star of a regex
-    def thompson(self) -> NFA[int]:
-        nfa = self.inner.thompson()
-
-        new_q0 = max(nfa.K) + 1
-        new_F = max(nfa.K) + 2
-
-        S = nfa.S | {EPSILON} # add epsilon to the alphabet
-        K = nfa.K | {new_q0, new_F}   # add the new initial and final states
+    def steps(self, nfa: NFA[int]) -> Generator[Regex, tuple[int, int], tuple[int, int]]:
+        new_q0 = nfa.new_state()
+        new_F = nfa.new_state()
+        start, end = yield self.inner
 
-        d = nfa.d.copy()
         # add an epsilon transition from the new initial state to the old first state and the new final state
-        d[new_q0, EPSILON] = {nfa.q0, new_F}
+        nfa.add_transition(new_q0, EPSILON, start)
+        nfa.add_transition(new_q0, EPSILON, new_F)
 
-        # for all the past final states, add epsilon transitions to the old initial state and the new final state
-        for state in nfa.F:
-            d[state, EPSILON] = {nfa.q0, new_F}
+        # from the old final state, add epsilon transitions to the old initial state and the new final state
+        nfa.add_transition(end, EPSILON, start)
+        nfa.add_transition(end, EPSILON, new_F)
 
-        return NFA(S=S, K=K, q0=new_q0, d=d, F={new_F})
+        return new_q0, new_F
 
 
 class Plus(Regex):
@@ -131,27 +177,20 @@ class Plus(Regex):
         self.inner = inner
 
     # implement the thompson construction for the plus of a regex
-    # similar to kleene star, but the new initial state doesn't have an epsilon transition to the new final state
-    def thompson(self) -> NFA[int]:
-        # nfa = self.inner.thompson()
-        #
-        # new_q0 = max(nfa.K) + 1
-        # new_F = max(nfa.K) + 2
-        #
-        # K = nfa.K | {new_q0, new_F}
-        #
-        # d = nfa.d.copy()
-        # d[new_q0, EPSILON] = {nfa.q0}   # add an epsilon transition from the new initial state to the old initial state
-        #
-        # # for all the past final states, add epsilon transitions to the old initial state and the new final state
-        # for state in nfa.F:
-        #     d[state, EPSILON] = {new_F, nfa.q0}
-        #
-        # return NFA(S=nfa.S, K=K, q0=new_q0, d=d, F={new_F})
-
-        return Concat(self.inner, Star(self.inner)).thompson() #using this: r.r* = r*.r = r+ regex identity
-
-        # return self.inner.thompson()
+    # similar to kleene star, but the new initial state doesn't have an epsilon transition to the new final state,
+    # so the inner regex is only built once
+    def steps(self, nfa: NFA[int]) -> Generator[Regex, tuple[int, int], tuple[int, int]]:
+        new_q0 = nfa.new_state()
+        new_F = nfa.new_state()
+        start, end = yield self.inner
+
+        nfa.add_transition(new_q0, EPSILON, start)   # add an epsilon transition from the new initial state to the old one
+
+        # from the old final state, add epsilon transitions to the old initial state and the new final state
+        nfa.add_transition(end, EPSILON, start)
+        nfa.add_transition(end, EPSILON, new_F)
+
+        return new_q0, new_F
 
 # quesiton mark
 class Maybe(Regex):
@@ -159,171 +198,188 @@ class Maybe(Regex):
         self.inner = inner
 
     # implement the thompson construction for the maybe of a regex
-    def thompson(self) -> NFA[int]:
-        nfa = self.inner.thompson()
+    def steps(self, nfa: NFA[int]) -> Generator[Regex, tuple[int, int], tuple[int, int]]:
+        new_q0 = nfa.new_state()
+        new_F = nfa.new_state()
+        start, end = yield self.inner
 
-        # make the initial state final
-        return NFA(S=nfa.S, K=nfa.K, q0=nfa.q0, d=nfa.d, F=nfa.F | {nfa.q0})
+        # the new initial state can skip the inner regex
+        nfa.add_transition(new_q0, EPSILON, start)
+        nfa.add_transition(new_q0, EPSILON, new_F)
+        nfa.add_transition(end, EPSILON, new_F)
 
+        return new_q0, new_F
 
-class Lowercase(Regex):
-    def __init__(self):
-        letters = [Character(chr(letter)) for letter in range(ord('a'), ord('z') + 1)]
-        self.regex = letters[0]
-        for letter in letters[1:]:
-            self.regex = Union(self.regex, letter)
 
-    # implement the thompson construction for a lowercase character
-    def thompson(self) -> NFA[int]:
-        return self.regex.thompson()
+class CharClass(Regex):
+    def __init__(self, ranges: list[tuple[str, str]], negated: bool = False):
+        # ranges of characters (both ends included). a negated class matches every character outside of them
+        self.ranges = sorted((ord(lo), ord(hi)) for lo, hi in ranges)
+        if negated:
+            self.ranges = complement(self.ranges)
 
-class Uppercase(Regex):
-    def __init__(self):
-        letters = [Character(chr(letter)) for letter in range(ord('A'), ord('Z') + 1)]
-        self.regex = letters[0]
-        for letter in letters[1:]:
-            self.regex = Union(self.regex, letter)
+    # implement the thompson construction for a class of characters: a single pair of states, with one transition for
+    # each range, labeled with the whole range instead of every character in it
+    def steps(self, nfa: NFA[int]) -> tuple[int, int]:
+        q0 = nfa.new_state()
+        q1 = nfa.new_state()
+        for lo, hi in self.ranges:
+            nfa.add_transition(q0, label(lo, hi), q1)
 
-    # implement the thompson construction for an uppercase character
-    def thompson(self) -> NFA[int]:
-        return self.regex.thompson()
+        return q0, q1
 
-class Digit(Regex):
+class Lowercase(CharClass):
     def __init__(self):
-        digits = [Character(str(digit)) for digit in range(10)]
-        self.regex = digits[0]
-        for digit in digits[1:]:
-            self.regex = Union(self.regex, digit)
-
-    # implement the thompson construction for a digit
-    def thompson(self) -> NFA[int]:
-        return self.regex.thompson()
-
-
-def process_char(char:str, regex:str):
-    global precedent, expression, operations, i
-
-    # add a concatenation operation if there was a precedent expression
-    if precedent:
-        operations.append('.')
-    precedent = True
-
-    # if the character is a backslash, escape the next character
-    if char == '\\' and i < len(regex) - 1:
-        i += 1
-        char = regex[i]
-
-    expression.append(Character(char))
-    i += 1
-
-
-def process_special_char(char:str, regex:str):
-    global precedent, expression, operations, i
-
-    # if the character is an open bracket, add a concatenation operation if there was a precedent expression
-    if char == '(':
-        if precedent:
-            operations.append('.')  # add a concatenation operation if there was a precedent expression
-
-        precedent = False   # no precedent expression after an open bracket
-        operations.append('(')
-        i += 1
-    # if the character is a closing bracket, process the operations and expressions until the last open bracket
-    elif char == ')':
-        while operations[-1] != '(':
-            op = operations.pop()
-
-            right = expression.pop()
-            left = expression.pop()
-
-            if op == '.':
-                expression.append(Concat(left, right))
-            elif op == '|':
-                expression.append(Union(left, right))
-
-        operations.pop() # remove the '('
-        i += 1
-        precedent = True # reset the precedent flag
-    # if the character is '|', process the operations and expressions until the last concatenation operation to obtain the nfa on the right side
-    elif char == '|':
-        while operations and operations[-1] == '.':
-            operations.pop()
-
-            right = expression.pop()
-            left = expression.pop()
-
-            expression.append(Concat(left, right))
-
-        operations.append('|')
-        i += 1
-        precedent = False   # no precedent expression after a '|'
-    # if the character is '*', '+', or '?', process the last expression
-    elif char in ['*', '+', '?']:
-        if char == '*':
-            expression.append(Star(expression.pop()))
-        elif char == '+':
-            expression.append(Plus(expression.pop()))
-        elif char == '?':
-            expression.append(Maybe(expression.pop()))
-
-        i += 1
-        precedent = True
-    # if the character is '[', process the range
-    elif char == '[':
-        if precedent:
-            operations.append('.')
-
-        closing = regex.find(']', i) # find the closing bracket position
-
-        if closing != -1 and closing - i == 4:
-            range = regex[i + 1: closing]
-
-            if range == "a-z":
-                expression.append(Lowercase())
-            elif range == "A-Z":
-                expression.append(Uppercase())
-            elif range == "0-9":
-                expression.append(Digit())
-
-            i = closing + 1
-            precedent = True # following expression concatenates
+        super().__init__([('a', 'z')])
 
+class Uppercase(CharClass):
+    def __init__(self):
+        super().__init__([('A', 'Z')])
 
-def parse_regex(regex: str) -> Regex:
-    global expression, operations, precedent, i
-    # create a Regex object by parsing the string
-
-    # you can define additional classes and functions to help with the parsing process
-
-    # the checker will call this function, then the thompson method of the generated object. the resulting NFA's
-    # behaviour will be checked using your implementation form stage 1
-
-    i = 0
-    precedent = False
-    expression = []
-    operations = []
-
-    # iterate over the regex and create the AST
-    while i < len(regex):
-        if regex[i] == ' ':
-            i += 1
-            continue
-
-        if regex[i] in special_chars:
-            process_special_char(regex[i], regex)
-        else:
-            process_char(regex[i], regex)
-
-    # process the remaining operations
-    while operations:
-        op = operations.pop()
-
-        right = expression.pop()
-        left = expression.pop()
+class Digit(CharClass):
+    def __init__(self):
+        super().__init__([('0', '9')])
+
+
+class RegexParser:
+    # parser for regexes. all of its state lives in the parser object, so any number of regexes can be parsed at the
+    # same time, from any thread. the grammar, from the lowest priority to the highest, is:
+    #   union   := concat ('|' concat)*
+    #   concat  := postfix+
+    #   postfix := atom ('*' | '+' | '?')*
+    #   atom    := '(' union ')' | '[' class ']' | '\\' char | char
+    # spaces are ignored outside of classes, unless they are escaped. the groups are parsed in a loop with a stack of
+    # the groups they are nested in, rather than recursively, so deeply nested groups don't hit the recursion limit
+
+    def __init__(self, regex: str):
+        self.regex = regex
+        self.pos = 0
+
+    def error(self, message: str, position: int | None = None) -> RegexSyntaxError:
+        return RegexSyntaxError(message, self.regex, self.pos if position is None else position)
+
+    def peek(self) -> str | None:
+        # the next character that is not a space, or None at the end of the regex
+        while self.pos < len(self.regex) and self.regex[self.pos] == ' ':
+            self.pos += 1
+        return self.regex[self.pos] if self.pos < len(self.regex) else None
+
+    def parse(self) -> Regex:
+        if self.peek() is None:
+            raise self.error("empty regex")
+
+        # the group being parsed: its alternatives before the last '|', the concatenation after it, and where the
+        # group starts. the groups it is nested in wait on the stack
+        alternatives, concat, start = [], None, None
+        stack = []
+
+        while True:
+            char = self.peek()
+            if char in (None, '|', ')'):
+                if concat is None:
+                    raise self.error("missing expression")
+                alternatives.append(concat)
+                if char == '|':
+                    self.pos += 1
+                    concat = None
+                    continue
+
+                regex = reduce(Union, alternatives)
+                if char is None:
+                    if stack:
+                        raise self.error("unbalanced '('", start)
+                    return regex
+                if not stack:
+                    raise self.error("unbalanced ')'")
+
+                # the group is over, and it is an atom of the group around it
+                self.pos += 1
+                alternatives, concat, start = stack.pop()
+            elif char == '(':
+                stack.append((alternatives, concat, start))
+                alternatives, concat, start = [], None, self.pos
+                self.pos += 1
+                continue
+            else:
+                regex = self.atom()
+
+            regex = self.postfix(regex)
+            concat = regex if concat is None else Concat(concat, regex)
+
+    def postfix(self, regex: Regex) -> Regex:
+        # apply the operators following an atom
+        while self.peek() in ('*', '+', '?'):
+            if self.regex[self.pos] == '*':
+                regex = Star(regex)
+            elif self.regex[self.pos] == '+':
+                regex = Plus(regex)
+            else:
+                regex = Maybe(regex)
+            self.pos += 1
+
+        return regex
+
+    def atom(self) -> Regex:
+        # an atom that is not a group
+        char = self.peek()
+        start = self.pos
+        self.pos += 1
+
+        if char == '[':
+            return self.char_class(start)
+        if char == ']':
+            raise self.error(f"unbalanced '{char}'", start)
+        if char in ('*', '+', '?'):
+            raise self.error(f"nothing to repeat with '{char}'", start)
+
+        # a backslash escapes the next character, unless it is the last one
+        if char == '\\' and self.pos < len(self.regex):
+            char = self.regex[self.pos]
+            self.pos += 1
+
+        return Character(char)
+
+    def char_class(self, start: int) -> CharClass:
+        # parse a [...] class, after its '[': single characters and ranges like a-z, '\\' escapes the next character
+        # and a '^' at the start negates the class
+        negated = self.pos < len(self.regex) and self.regex[self.pos] == '^'
+        if negated:
+            self.pos += 1
+
+        chars = []  # the characters of the class with their position, and a flag telling if they are a range '-'
+        while self.pos < len(self.regex) and self.regex[self.pos] != ']':
+            char = self.regex[self.pos]
+            if char == '\\' and self.pos + 1 < len(self.regex):
+                chars.append((self.regex[self.pos + 1], self.pos, False))
+                self.pos += 2
+            else:
+                chars.append((char, self.pos, char == '-'))
+                self.pos += 1
+
+        if self.pos == len(self.regex):
+            raise self.error("unterminated class", start)
+        self.pos += 1
+
+        if not chars:
+            raise self.error("empty class", start)
+
+        ranges = []
+        j = 0
+        while j < len(chars):
+            # a '-' between two characters makes a range, anywhere else it is just a character
+            if j + 2 < len(chars) and chars[j + 1][2]:
+                lo, hi = chars[j][0], chars[j + 2][0]
+                if lo > hi:
+                    raise self.error(f"invalid range {lo}-{hi}", chars[j][1])
+                ranges.append((lo, hi))
+                j += 3
+            else:
+                ranges.append((chars[j][0], chars[j][0]))
+                j += 1
+
+        return CharClass(ranges, negated)
 
-        if op == '.':
-            expression.append(Concat(left, right))
-        elif op == '|':
-            expression.append(Union(left, right))
 
-    return expression[0]
+def parse_regex(regex: str) -> Regex:
+    # create a Regex object by parsing the string. raises RegexSyntaxError if the regex is not valid
+    return RegexParser(regex).parse()
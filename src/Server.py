@@ -0,0 +1,358 @@
+from src.Lexer import Lexer, chunk_bounds, lex_chunk, stitch
+from src.LexerPool import LexerPool, spec_key
+from src.Stats import ServerStats
+from argparse import ArgumentParser
+from array import array
+from collections.abc import AsyncIterator, Callable
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import aclosing, suppress
+from time import perf_counter
+import asyncio
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import sys
+import tempfile
+
+DEFAULT_PORT = 8765
+WINDOW_SIZE = 1 << 16  # texts are split in windows of about this many characters, lexed in parallel
+BATCH_SIZE = 1000  # the number of tokens sent in every line of an answer
+LINE_LIMIT = 1 << 28  # the longest request line accepted, in bytes
+
+# the lexers of a worker process of the server, created by init_worker
+WORKER_LEXERS: LexerPool | None = None
+
+
+class Server:
+    # a lexing service over tcp, speaking newline delimited json. every line sent by a client is a request
+    #   {"id": ..., "spec": [[token, regex], ...], "text": "...", "skip": [token, ...]}
+    # (skip is optional) answered by lines of up to batch_size tokens {"id": ..., "tokens": [[token, lexeme], ...]}
+    # sent while the text is lexed, and a last line {"id": ..., "done": true, "count": number of tokens}. if the text
+    # can't be lexed, the last line is {"id": ..., "lex_error": message} instead, with the message of Lexer.lex, and
+    # an invalid request gets {"id": ..., "error": message}. {"id": ..., "stats": true} gets the counters of the
+    # server in {"id": ..., "stats": {...}}. the requests of a connection are answered in order.
+    # the lexers are compiled in a pool of worker processes, which save their tables in a cache directory shared with
+    # the server, and are kept by spec in lexer pools in the server and in every worker. the texts are lexed by the
+    # workers in windows, like Lexer.lex_parallel does, so the event loop only stitches the windows together and sends
+    # the tokens
+
+    def __init__(self, host: str = '127.0.0.1', port: int = DEFAULT_PORT, workers: int | None = None,
+                 capacity: int = 64, cache_dir: str | os.PathLike | None = None, window_size: int = WINDOW_SIZE,
+                 batch_size: int = BATCH_SIZE) -> None:
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.window_size = window_size
+        self.batch_size = batch_size
+        self.temporary = cache_dir is None  # a temporary cache directory is removed when the server is closed
+        self.cache_dir = tempfile.mkdtemp(prefix='lexers-') if cache_dir is None else cache_dir
+        self.lexers = LexerPool(capacity, self.cache_dir)
+        self.building: dict[str, asyncio.Future] = {}  # the specs being compiled by a worker
+        self.writers: set[asyncio.StreamWriter] = set()  # the open connections
+        self.stats = ServerStats()
+        self.executor = None
+        self.server = None
+
+    async def start(self) -> None:
+        self.executor = self.start_workers()
+        self.server = await asyncio.start_server(self.handle, self.host, self.port, limit=LINE_LIMIT)
+        # with port 0, the system picks a free port
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    def start_workers(self) -> ProcessPoolExecutor:
+        # the workers are spawned rather than forked: a forked worker would keep a copy of the sockets of the
+        # connections open when it started, and they would not be closed with the connection
+        return ProcessPoolExecutor(self.workers, multiprocessing.get_context('spawn'), init_worker,
+                                   (self.lexers.capacity, self.cache_dir))
+
+    async def run(self, function: Callable, *args) -> object:
+        # call a function in a worker. when a worker dies (killed, or out of memory), the pool is broken and fails all
+        # its calls, so it is replaced. a call the broken pool refused is sent to the new one, the calls it was running
+        # fail
+        loop = asyncio.get_running_loop()
+        executor = self.executor
+        try:
+            future = loop.run_in_executor(executor, function, *args)
+        except BrokenProcessPool:
+            self.replace_workers(executor)
+            executor = self.executor
+            future = loop.run_in_executor(executor, function, *args)
+
+        try:
+            return await future
+        except BrokenProcessPool:
+            self.replace_workers(executor)
+            raise
+
+    def replace_workers(self, executor: ProcessPoolExecutor) -> None:
+        # replace a broken pool of workers, unless another call already did
+        if self.executor is executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = self.start_workers()
+
+    async def serve_forever(self) -> None:
+        if self.server is None:
+            await self.start()
+        await self.server.serve_forever()
+
+    async def close(self) -> None:
+        # stop accepting connections and close the open ones, without waiting for the requests being answered
+        if self.server is not None:
+            self.server.close()
+            for writer in self.writers:
+                writer.close()
+            await self.server.wait_closed()
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+        if self.temporary:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    async def __aenter__(self) -> 'Server':
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        # answer the requests of a connection, one line at a time, until the client closes it
+        self.stats.connections += 1
+        self.writers.add(writer)
+        try:
+            while line := await reader.readline():
+                if line.strip():
+                    await self.answer(line, writer)
+        except ValueError:
+            # the line was longer than the limit, and the rest of the stream can't be read as lines
+            self.stats.errors += 1
+            await send(writer, {'id': None, 'error': f'request longer than {LINE_LIMIT} bytes'})
+        except ConnectionError:
+            pass
+        finally:
+            self.stats.connections -= 1
+            self.writers.discard(writer)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def answer(self, line: bytes, writer: asyncio.StreamWriter) -> None:
+        start_time = perf_counter()
+        stats = self.stats
+        stats.requests += 1
+        stats.active += 1
+        request_id = None
+        try:
+            try:
+                request = parse_request(line)
+                request_id = request.get('id')
+                if not request.get('stats'):
+                    spec, text = request['spec'], request['text']
+                    lexer = await self.lexer(spec)
+                    skip = skipped(lexer, request.get('skip', []))
+            except Exception as e:
+                # an invalid request, or a spec that could not be compiled: its regexes may not parse, or the worker
+                # compiling it may have failed in any other way
+                stats.errors += 1
+                await send(writer, {'id': request_id, 'error': error_text(e)})
+                return
+
+            if request.get('stats'):
+                await send(writer, {'id': request_id, 'stats': self.counters()})
+                return
+
+            stats.chars += len(text)
+            tokens, batch = lexer.tokens, []
+            count = 0
+            try:
+                async with aclosing(self.matches(lexer, spec, text)) as matches:
+                    async for found in matches:
+                        for token, start, end in found:
+                            if token < 0:
+                                stats.errors += 1
+                                await send(writer, {'id': request_id, 'lex_error': lexer.error(text, start)})
+                                return
+
+                            if token not in skip:
+                                count += 1
+                                batch.append((tokens[token], text[start:end]))
+                                if len(batch) == self.batch_size:
+                                    await send(writer, {'id': request_id, 'tokens': batch})
+                                    batch = []
+            except ConnectionError:
+                raise
+            except Exception as e:
+                # a worker lexing the windows failed, the tokens sent so far are followed by the error
+                stats.errors += 1
+                await send(writer, {'id': request_id, 'error': error_text(e)})
+                return
+
+            if batch:
+                await send(writer, {'id': request_id, 'tokens': batch})
+            await send(writer, {'id': request_id, 'done': True, 'count': count})
+            stats.tokens += count
+        finally:
+            stats.active -= 1
+            stats.record(perf_counter() - start_time)
+
+    async def lexer(self, spec: list[tuple[str, str]]) -> Lexer:
+        # the lexer of a spec. a spec in the pool is only looked up there, the others are compiled by self.compile.
+        # requests for a spec being compiled wait for it
+        if spec in self.lexers:
+            self.stats.lexer_hits += 1
+            return self.lexers.get(spec)
+
+        key = spec_key(spec)
+        building = self.building.get(key)
+        if building is None:
+            self.stats.lexer_misses += 1
+            building = self.building[key] = asyncio.ensure_future(self.compile(spec))
+            # only the compilation itself forgets the spec once it ends, whatever happens to the requests waiting for it
+            building.add_done_callback(lambda _: self.building.pop(key, None))
+        else:
+            self.stats.lexer_hits += 1
+
+        # shielded, so a request whose connection is closed doesn't stop the compilation the others wait for
+        lexer = await asyncio.shield(building)
+
+        self.stats.lexer_evictions = self.lexers.evictions
+        return lexer
+
+    async def compile(self, spec: list[tuple[str, str]]) -> Lexer:
+        # compile a spec in a worker, which saves its tables in the cache directory, then load them from there into
+        # the pool. loading hashes the sources, reads the tables and compiles the regexes of their runs, so it is done
+        # in a thread rather than on the event loop
+        await self.run(build, spec)
+        lexer = await asyncio.get_running_loop().run_in_executor(None, Lexer, spec, self.cache_dir)
+        return self.lexers.add(spec, lexer)
+
+    async def matches(self, lexer: Lexer, spec: list[tuple[str, str]], text: str) \
+            -> AsyncIterator[list[tuple[int, int, int]]]:
+        # the (token id, start, end) of every token of the text, in lists of the tokens found at once, ending with
+        # (-1, pos, pos) if no token matches at pos. the windows are lexed by the workers as if a token started at
+        # their beginning, and stitched together here with stitch, like in Lexer.lex_parallel
+        bounds = chunk_bounds(text, self.window_size)
+        windows = [asyncio.ensure_future(self.run(lex_window, spec, text[bounds[k]:bounds[k + 1]],
+                                                  k == len(bounds) - 2)) for k in range(len(bounds) - 1)]
+        pos = 0
+
+        try:
+            for k, window in enumerate(windows):
+                # a token may run over whole windows, which are then not waited for
+                if pos >= bounds[k + 1]:
+                    continue
+
+                for found in stitch(lexer.compiled, lexer.keywords, text, bounds[k], bounds[k + 1], pos, await window):
+                    yield found
+                    token, _, pos = found[-1]
+                    if token < 0:
+                        return
+        finally:
+            for window in windows:
+                # the error of a window that failed without being waited for is dropped, rather than logged
+                if not window.cancel() and not window.cancelled():
+                    window.exception()
+
+    def counters(self) -> dict:
+        self.stats.lexer_evictions = self.lexers.evictions
+        counters = self.stats.as_dict()
+        counters['lexers'] = len(self.lexers)
+        return counters
+
+
+async def send(writer: asyncio.StreamWriter, message: dict) -> None:
+    # write a line of json, waiting if the client is slower to read than the server is to write
+    writer.write(json.dumps(message).encode('utf-8') + b'\n')
+    await writer.drain()
+
+
+def parse_request(line: bytes) -> dict:
+    # the request on a line, with its fields checked. raises ValueError if it is not valid
+    request = json.loads(line)
+    if not isinstance(request, dict):
+        raise ValueError('a request must be a json object')
+    if request.get('stats'):
+        return request
+
+    spec, text, skip = request.get('spec'), request.get('text'), request.get('skip', [])
+    if not isinstance(spec, list) or not spec or not all(
+            isinstance(rule, list) and len(rule) == 2 and all(isinstance(part, str) for part in rule)
+            for rule in spec):
+        raise ValueError('spec must be a non empty list of [token, regex] pairs')
+    if not isinstance(text, str):
+        raise ValueError('text must be a string')
+    if not isinstance(skip, list) or not all(isinstance(token, str) for token in skip):
+        raise ValueError('skip must be a list of token names')
+
+    request['spec'] = [(token, regex) for token, regex in spec]
+    return request
+
+
+def error_text(error: Exception) -> str:
+    # the message of an error, or its type for the errors without one
+    return str(error) or type(error).__name__
+
+
+def skipped(lexer: Lexer, skip: list[str]) -> frozenset[int]:
+    # the ids of the tokens to leave out of an answer
+    unknown = set(skip) - set(lexer.tokens)
+    if unknown:
+        raise ValueError(f"unknown tokens to skip: {', '.join(sorted(unknown))}")
+    return frozenset(i for i, token in enumerate(lexer.tokens) if token in skip)
+
+
+def init_worker(capacity: int, cache_dir: str | os.PathLike) -> None:
+    global WORKER_LEXERS
+    WORKER_LEXERS = LexerPool(capacity, cache_dir)
+
+
+def build(spec: list[tuple[str, str]]) -> None:
+    # compile a spec in a worker, saving its tables in the cache directory
+    WORKER_LEXERS.get(spec)
+
+
+def lex_window(spec: list[tuple[str, str]], window: str, last: bool) -> tuple[array, array, array, int, bool]:
+    # lex a window of a text in a worker, with lex_chunk
+    lexer = WORKER_LEXERS.get(spec)
+    return lex_chunk(lexer.compiled, window, last, lexer.keywords)
+
+
+async def serve(server: Server) -> None:
+    # serve until the process is interrupted or terminated, then close the server
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        # signal handlers can't be set on every platform, there only a KeyboardInterrupt stops the server
+        with suppress(NotImplementedError):
+            loop.add_signal_handler(signum, stop.set)
+
+    async with server:
+        print(f'lexing on {server.host}:{server.port}', file=sys.stderr)
+        await stop.wait()
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = ArgumentParser(description='serve lexers over tcp, as newline delimited json')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per cpu)')
+    parser.add_argument('--capacity', type=int, default=64, help='compiled lexers kept in memory')
+    parser.add_argument('--cache-dir', default=None, help='directory for the compiled tables (default: temporary)')
+    parser.add_argument('--window-size', type=int, default=WINDOW_SIZE)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    server = Server(args.host, args.port, args.workers, args.capacity, args.cache_dir, args.window_size,
+                    args.batch_size)
+    try:
+        asyncio.run(serve(server))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+from collections import deque
+from dataclasses import asdict, dataclass, field, fields
+from time import perf_counter
+import json
+
+LATENCY_WINDOW = 10000  # the number of recent requests whose latencies a ServerStats keeps
+
+
+@dataclass
+class LexerStats:
+    # counters of a lexer built with stats=True: what building it cost, and what the words it lexed cost.
+    # the build counters are left at 0 for a lexer loaded from the cache
+
+    # build: the number of nfa states of every rule (0 for the words looked up as keywords, and the words of the
+    # trie are counted together under 'trie'), the size of the whole nfa and of the dfa before and after minimization
+    rule_states: dict[str, int] = field(default_factory=dict)
+    nfa_states: int = 0
+    nfa_transitions: int = 0
+    closures: int = 0  # epsilon closures computed by the subset construction
+    subset_states: int = 0
+    dfa_states: int = 0  # states of the compiled dfa, including the dead state
+    dfa_transitions: int = 0  # transitions of the compiled dfa that don't go to the dead state
+    symbol_classes: int = 0
+    keywords: int = 0
+    cached: bool = False
+    build_seconds: dict[str, float] = field(default_factory=dict)  # time spent in each stage of the build
+
+    # scanning: lookahead is the number of characters read for every token (from its start to where the dfa died),
+    # backtrack the number of those read past the end of the token, which had to be read again for the next one
+    words: int = 0
+    chars: int = 0
+    tokens: int = 0
+    errors: int = 0
+    lex_seconds: float = 0.0
+    lookahead: int = 0
+    max_lookahead: int = 0
+    backtrack: int = 0
+    max_backtrack: int = 0
+    token_counts: dict[str, int] = field(default_factory=dict)
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.tokens / self.lex_seconds if self.lex_seconds else 0.0
+
+    @property
+    def average_lookahead(self) -> float:
+        return self.lookahead / self.tokens if self.tokens else 0.0
+
+    @property
+    def average_backtrack(self) -> float:
+        return self.backtrack / self.tokens if self.tokens else 0.0
+
+    def as_dict(self) -> dict:
+        # the counters and the rates computed from them, as plain values
+        stats = asdict(self)
+        stats['tokens_per_second'] = self.tokens_per_second
+        stats['average_lookahead'] = self.average_lookahead
+        stats['average_backtrack'] = self.average_backtrack
+        return stats
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.as_dict(), **kwargs)
+
+
+@dataclass
+class ServerStats:
+    # counters of a lexing server since it started. the latencies (from reading a request to writing the end of its
+    # answer) are only kept for the last LATENCY_WINDOW requests, which the percentiles are computed on
+    requests: int = 0
+    errors: int = 0  # requests that were invalid or whose text could not be lexed
+    active: int = 0  # requests being answered
+    connections: int = 0  # open connections
+    chars: int = 0
+    tokens: int = 0
+    lexer_hits: int = 0  # requests whose lexer was already compiled
+    lexer_misses: int = 0
+    lexer_evictions: int = 0
+    started: float = field(default_factory=perf_counter)
+    latencies: deque = field(default_factory=lambda: deque(maxlen=LATENCY_WINDOW))
+
+    @property
+    def uptime(self) -> float:
+        return perf_counter() - self.started
+
+    def record(self, seconds: float) -> None:
+        self.latencies.append(seconds)
+
+    def percentile(self, q: float) -> float:
+        # the latency below which a fraction q of the recent requests were answered
+        if not self.latencies:
+            return 0.0
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    def as_dict(self) -> dict:
+        # the counters, the rates since the start and the latency percentiles, as plain values
+        stats = {f.name: getattr(self, f.name) for f in fields(self) if f.name not in ('started', 'latencies')}
+        uptime = self.uptime
+        stats['uptime'] = uptime
+        stats['requests_per_second'] = self.requests / uptime if uptime else 0.0
+        stats['chars_per_second'] = self.chars / uptime if uptime else 0.0
+        stats['tokens_per_second'] = self.tokens / uptime if uptime else 0.0
+        for name, q in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+            stats[f'latency_{name}'] = self.percentile(q)
+        stats['latency_max'] = max(self.latencies, default=0.0)
+        return stats
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.as_dict(), **kwargs)
@@ -0,0 +1,85 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+
+
+@dataclass
+class TokenBatch:
+    # the tokens of many words lexed at once, as columns: the i-th token has the id ids[i], spans starts[i]:ends[i] in
+    # the word with index inputs[i], and its name is tokens[ids[i]]. errors holds the (word index, message) of every
+    # word that could not be lexed
+    tokens: list[str]
+    ids: array
+    starts: array
+    ends: array
+    inputs: array
+    errors: list[tuple[int, str]]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def word_tokens(self, words: list[str], index: int) -> list[tuple[str, str]]:
+        # the tokens of one of the words, in the same form as Lexer.lex gives them. the tokens are sorted by word, so
+        # the ones of the word are found by bisection
+        first, last = bisect_left(self.inputs, index), bisect_right(self.inputs, index)
+        return [(self.tokens[self.ids[i]], words[index][self.starts[i]:self.ends[i]]) for i in range(first, last)]
+
+
+class Token:
+    # a single token of a Tokens list, built when it is indexed
+    __slots__ = ('name', 'id', 'lexeme', 'start', 'end', 'line', 'column')
+
+    def __init__(self, name: str, id: int, lexeme: str, start: int, end: int, line: int, column: int):
+        self.name = name
+        self.id = id
+        self.lexeme = lexeme
+        self.start = start
+        self.end = end
+        self.line = line
+        self.column = column
+
+    def __repr__(self) -> str:
+        return f"Token({self.name!r}, {self.lexeme!r}, line={self.line}, column={self.column})"
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Token):
+            return NotImplemented
+        return all(getattr(self, slot) == getattr(other, slot) for slot in self.__slots__)
+
+
+@dataclass
+class Tokens:
+    # the tokens of a word, as columns: the i-th token has the id ids[i] (its name is names[ids[i]]), spans
+    # starts[i]:ends[i] in the text and starts at lines[i], columns[i]. the lexemes are only cut out of the text when
+    # they are asked for. if the word could not be lexed to the end, error holds the message and the tokens stop
+    # before it
+    names: list[str]
+    text: str
+    ids: array = field(default_factory=lambda: array('i'))
+    starts: array = field(default_factory=lambda: array('q'))
+    ends: array = field(default_factory=lambda: array('q'))
+    lines: array = field(default_factory=lambda: array('q'))
+    columns: array = field(default_factory=lambda: array('q'))
+    error: str | None = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, i: int) -> Token:
+        token = self.ids[i]
+        start, end = self.starts[i], self.ends[i]
+        return Token(self.names[token], token, self.text[start:end], start, end, self.lines[i], self.columns[i])
+
+    def __iter__(self) -> Iterator[Token]:
+        return (self[i] for i in range(len(self.ids)))
+
+    def lexeme(self, i: int) -> str:
+        return self.text[self.starts[i]:self.ends[i]]
+
+    def pairs(self) -> list[tuple[str, str]]:
+        # the tokens in the same form as Lexer.lex gives them
+        if self.error is not None:
+            return [("", self.error)]
+        return [(self.names[token], self.text[start:end])
+                for token, start, end in zip(self.ids, self.starts, self.ends)]
@@ -0,0 +1,110 @@
+from .Alphabet import label
+from .CompiledDFA import CompiledDFA, DEAD
+from .NFA import NFA
+
+# the last code point encoded with 1, 2 and 3 bytes in utf-8
+UTF8_LIMITS = [0x7F, 0x7FF, 0xFFFF]
+SURROGATES = (0xD800, 0xDFFF)  # code points that have no utf-8 encoding
+
+
+def utf8_sequences(lo: int, hi: int) -> list[list[tuple[int, int]]]:
+    # split the code points between lo and hi (both included) into sequences of byte ranges, so that the utf-8
+    # encodings of the code points are exactly the byte strings matched by one of the sequences
+    sequences = []
+    stack = [(lo, hi)]
+    while stack:
+        lo, hi = stack.pop()
+        if lo > hi:
+            continue
+
+        # the surrogates are left out
+        if lo <= SURROGATES[1] and hi >= SURROGATES[0]:
+            stack.append((SURROGATES[1] + 1, hi))
+            stack.append((lo, SURROGATES[0] - 1))
+            continue
+
+        # a range whose code points have encodings of different lengths is split at the limit
+        limit = next((limit for limit in UTF8_LIMITS if lo <= limit < hi), None)
+        if limit is not None:
+            stack.append((limit + 1, hi))
+            stack.append((lo, limit))
+            continue
+
+        if hi <= 0x7F:
+            sequences.append([(lo, hi)])
+            continue
+
+        # split the range until every byte after the first one covers all of its continuation values, or is the same
+        # for all the code points
+        length = len(chr(lo).encode('utf-8'))
+        for i in range(1, length):
+            mask = (1 << 6 * i) - 1
+            if lo & ~mask != hi & ~mask:
+                if lo & mask:
+                    stack.append(((lo | mask) + 1, hi))
+                    stack.append((lo, lo | mask))
+                    break
+                if hi & mask != mask:
+                    stack.append((hi & ~mask, hi))
+                    stack.append((lo, (hi & ~mask) - 1))
+                    break
+        else:
+            first, last = chr(lo).encode('utf-8'), chr(hi).encode('utf-8')
+            sequences.append(list(zip(first, last)))
+
+    return sequences
+
+
+def utf8_dfa(compiled: CompiledDFA) -> CompiledDFA:
+    # build a dfa over the utf-8 bytes of the words accepted by a compiled dfa over characters, accepting the same
+    # tokens. every transition on a class of characters becomes a chain of transitions on ranges of bytes, and the
+    # result is determinized and minimized again, so its classes are a list with the class of each of the 256 bytes
+    n_states = len(compiled.accepts)
+    nfa = NFA(set(), set(range(n_states)), compiled.q0, {}, set())
+
+    # the code point ranges of every class
+    ranges = {}
+    for char, cls in sorted(compiled.classes.items()):
+        code = ord(char)
+        class_ranges = ranges.setdefault(cls, [])
+        if class_ranges and class_ranges[-1][1] == code - 1:
+            class_ranges[-1] = (class_ranges[-1][0], code)
+        else:
+            class_ranges.append((code, code))
+    for lo, hi, cls in zip(compiled.starts, compiled.ends, compiled.range_classes):
+        ranges.setdefault(cls, []).append((lo, hi))
+
+    sequences = {cls: [seq for lo, hi in class_ranges for seq in utf8_sequences(lo, hi)]
+                 for cls, class_ranges in ranges.items()}
+
+    # the states in the middle of a character are shared by all the chains with the same rest of the sequence and
+    # the same target
+    middles = {}
+
+    def middle(rest: tuple[tuple[int, int], ...], target: int) -> int:
+        state = middles.get((rest, target))
+        if state is None:
+            state = middles[rest, target] = nfa.new_state()
+            following = middle(rest[1:], target) if len(rest) > 1 else target
+            nfa.add_transition(state, label(*rest[0]), following)
+        return state
+
+    for state in range(1, n_states):
+        for cls, class_sequences in sequences.items():
+            target = compiled.table[state * compiled.n_classes + cls]
+            if target == DEAD:
+                continue
+
+            for sequence in class_sequences:
+                following = middle(tuple(sequence[1:]), target) if len(sequence) > 1 else target
+                nfa.add_transition(state, label(*sequence[0]), following)
+
+        if compiled.accepts[state] >= 0:
+            nfa.F.add(state)
+
+    # the only states of the nfa that accept are the states of the compiled dfa, and a subset has at most one of them
+    token = lambda subset: max((compiled.accepts[s] for s in subset if s < n_states), default=-1)
+    utf8 = nfa.subset_construction().minimize(token).compile(token)
+
+    classes = [utf8.symbol_class(chr(byte)) for byte in range(256)]
+    return CompiledDFA(classes=classes, n_classes=utf8.n_classes, q0=utf8.q0, table=utf8.table, accepts=utf8.accepts)